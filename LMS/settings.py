@@ -215,3 +215,46 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 SESSION_COOKIE_AGE = 1209600  # 2 weeks in seconds
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False  # Do not log out on browser close
 SESSION_ENGINE = "django.contrib.sessions.backends.db"  # Default session engine
+
+# Quizzes
+# Number of compiled quiz answer keys kept in memory by each worker process
+QUIZ_ANSWER_KEY_CACHE_SIZE = 256
+# How long pre-rendered quiz payloads stay cached, a quiz edit invalidates them anyway
+QUIZ_PAYLOAD_CACHE_TIMEOUT = 60 * 60 * 24
+# Store quiz answers packed on the attempt row instead of one Answer row per question
+QUIZ_COMPACT_ANSWERS = False
+
+# Comments
+# Dispatch comment notifications from a background thread right after the commit.
+# When False they are only sent by the dispatch_comment_fanout command.
+COMMENT_FANOUT_IN_PROCESS = True
+# Remove the files of deleted comments from a background thread right after the
+# commit. When False they are only removed by the collect_deleted_media command.
+MEDIA_GC_IN_PROCESS = True
+# Render the resized variants of uploaded comment images from a background thread
+# right after the commit. When False they are only rendered by the
+# process_comment_images command.
+COMMENT_IMAGE_PROCESSING_IN_PROCESS = True
+# Worker processes used to resize comment images
+COMMENT_IMAGE_WORKERS = 2
+# Largest comment image accepted, uploads are rejected as soon as they pass it
+COMMENT_IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+
+# Notifications
+# Replies and student comments for the same receiver and lesson within this many
+# seconds are folded into one notification, 0 disables coalescing
+NOTIFICATION_COALESCE_WINDOW = 10 * 60
+# Push coalesced notifications from the send_notification_digests command instead
+# of as they come
+NOTIFICATION_DIGEST = False
+# archive_notifications moves notifications older than this out of the database
+NOTIFICATION_RETENTION_DAYS = 180
+# Where archive_notifications writes its files
+NOTIFICATION_ARCHIVE_DIR = BASE_DIR / "archive" / "notifications"
+# A user's last_seen_notifications is written at most once per this many seconds
+# per process, later updates are buffered until the end of the interval
+LAST_SEEN_WRITE_INTERVAL = 5
+
+# Search
+# Postgres text search configuration used to index and query documents
+SEARCH_CONFIG = "english"
@@ -58,18 +58,20 @@ const CommentPage: React.FC = () => {
                 </div>
               </div>
               <div className="comment-images">
-                {comment.images?.map((imageObj, index) => (
-                  <div key={index} className="comment-image-container">
-                    <img
-                      src={String(imageObj.image)}
-                      alt="screenshots"
-                      className="comment-image"
-                      onClick={() =>
-                        window.open(String(imageObj.image), "_blank")
-                      }
-                    />
-                  </div>
-                ))}
+                {comment.images
+                  ?.filter((imageObj) => imageObj.thumbnail)
+                  .map((imageObj, index) => (
+                    <div key={index} className="comment-image-container">
+                      <img
+                        src={String(imageObj.thumbnail)}
+                        alt="screenshots"
+                        className="comment-image"
+                        onClick={() =>
+                          window.open(String(imageObj.display), "_blank")
+                        }
+                      />
+                    </div>
+                  ))}
               </div>
               <div className="comment-time">
                 {new Date(comment.commented_at).toLocaleString()}
@@ -114,18 +116,26 @@ const CommentPage: React.FC = () => {
                         </div>
                       </div>
                       <div className="comment-images">
-                        {reply.images?.map((imageObj, index) => (
-                          <div key={index} className="comment-image-container">
-                            <img
-                              src={String(imageObj.image)}
-                              alt="screenshots"
-                              className="comment-image"
-                              onClick={() =>
-                                window.open(String(imageObj.image), "_blank")
-                              }
-                            />
-                          </div>
-                        ))}
+                        {reply.images
+                          ?.filter((imageObj) => imageObj.thumbnail)
+                          .map((imageObj, index) => (
+                            <div
+                              key={index}
+                              className="comment-image-container"
+                            >
+                              <img
+                                src={String(imageObj.thumbnail)}
+                                alt="screenshots"
+                                className="comment-image"
+                                onClick={() =>
+                                  window.open(
+                                    String(imageObj.display),
+                                    "_blank"
+                                  )
+                                }
+                              />
+                            </div>
+                          ))}
                       </div>
                       <div className="comment-time">
                         {new Date(reply.commented_at).toLocaleString()}
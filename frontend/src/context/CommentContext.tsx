@@ -25,6 +25,9 @@ export interface Comment {
   replies: number[];
   images: {
     image: string | File | null;
+    // Resized copies, null until the server has rendered them
+    thumbnail: string | null;
+    display: string | null;
   }[];
 }
 
@@ -0,0 +1,164 @@
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from main.models import (
+    Question,
+    QuizAttempt,
+    QuizAttemptState,
+    Answer,
+    QuizStats,
+    QuestionStats,
+)
+
+
+# Quiz analytics are folded in batch by batch: each run only reads the attempts
+# still marked stats_pending and clears the mark, so serving stats costs
+# O(questions) however many attempts a quiz has accumulated. The mark is kept
+# on each attempt rather than as an id watermark: an attempt whose transaction
+# commits after one with a higher id is still counted by the next run.
+
+
+def _count_answers(stats, answer_text, is_correct, answers):
+    if stats is None:
+        return
+    stats.attempt_count += answers
+    if is_correct:
+        stats.correct_count += answers
+    if answer_text is not None:
+        stats.choice_counts[answer_text] = (
+            stats.choice_counts.get(answer_text, 0) + answers
+        )
+
+
+def refresh_quiz_stats(quiz_id, batch_size=5000):
+    with transaction.atomic():
+        quiz_stats, _ = QuizStats.objects.select_for_update().get_or_create(
+            quiz_id=quiz_id
+        )
+        question_stats = {
+            stats.question_id: stats
+            for stats in QuestionStats.objects.filter(quiz_id=quiz_id)
+        }
+        new_question_stats = [
+            QuestionStats(question_id=question_id, quiz_id=quiz_id)
+            for question_id in Question.objects.filter(quiz_id=quiz_id)
+            .exclude(id__in=question_stats.keys())
+            .values_list("id", flat=True)
+        ]
+        question_stats.update(
+            (stats.question_id, stats) for stats in new_question_stats
+        )
+
+        while True:
+            attempts = list(
+                QuizAttempt.objects.filter(quiz_id=quiz_id, stats_pending=True)
+                .order_by("id")
+                .values_list("id", "score", "packed_answers")[:batch_size]
+            )
+            if not attempts:
+                break
+            attempt_ids = [attempt_id for attempt_id, _, _ in attempts]
+            for _, score, packed_answers in attempts:
+                key = str(score)
+                quiz_stats.score_histogram[key] = (
+                    quiz_stats.score_histogram.get(key, 0) + 1
+                )
+                # Compact attempts have no Answer rows, they are counted here
+                for question_id, answer_text, is_correct in packed_answers or []:
+                    _count_answers(
+                        question_stats.get(question_id), answer_text, is_correct, 1
+                    )
+            quiz_stats.attempt_count += len(attempts)
+
+            # Answers of the whole batch are grouped in SQL
+            answer_counts = (
+                Answer.objects.filter(attempt_id__in=attempt_ids)
+                .values("question_id", "answer_text", "is_correct")
+                .annotate(answers=Count("id"))
+                .order_by()
+            )
+            for row in answer_counts:
+                _count_answers(
+                    question_stats.get(row["question_id"]),
+                    row["answer_text"],
+                    row["is_correct"],
+                    row["answers"],
+                )
+            QuizAttempt.objects.filter(id__in=attempt_ids).update(stats_pending=False)
+
+        existing_question_stats = [
+            stats for stats in question_stats.values() if stats.pk
+        ]
+        QuestionStats.objects.bulk_create(new_question_stats)
+        QuestionStats.objects.bulk_update(
+            existing_question_stats,
+            ["attempt_count", "correct_count", "choice_counts"],
+            batch_size=500,
+        )
+        quiz_stats.updated_at = timezone.now()
+        quiz_stats.save()
+    return quiz_stats
+
+
+def refresh_stale_quiz_stats(batch_size=5000):
+    """Refresh every quiz that has attempts newer than its aggregated stats."""
+    quiz_ids = list(
+        QuizAttempt.objects.filter(stats_pending=True)
+        .values_list("quiz_id", flat=True)
+        .order_by("quiz_id")
+        .distinct()
+    )
+    for quiz_id in quiz_ids:
+        refresh_quiz_stats(quiz_id, batch_size=batch_size)
+    return len(quiz_ids)
+
+
+def reset_quiz_stats(quiz_id):
+    # Called after re-grading, the next refresh rebuilds everything from scratch
+    QuizStats.objects.filter(quiz_id=quiz_id).delete()
+    QuestionStats.objects.filter(quiz_id=quiz_id).delete()
+    QuizAttempt.objects.filter(quiz_id=quiz_id, stats_pending=False).update(
+        stats_pending=True
+    )
+
+
+# Leaderboard, served from the best score kept on each QuizAttemptState row.
+# Both lookups are index range scans on (quiz, best_score), never a sort over
+# all attempts.
+
+
+def get_leaderboard(quiz_id, limit):
+    entries = list(
+        QuizAttemptState.objects.filter(quiz_id=quiz_id)
+        .select_related("user")
+        .only(
+            "user__id",
+            "user__first_name",
+            "user__last_name",
+            "best_score",
+            "best_scored_at",
+        )
+        .order_by("-best_score", "best_scored_at")[:limit]
+    )
+    # Competition ranking: equal scores share a rank
+    for position, entry in enumerate(entries):
+        if position and entry.best_score == entries[position - 1].best_score:
+            entry.rank = entries[position - 1].rank
+        else:
+            entry.rank = position + 1
+    return entries
+
+
+def get_rank(quiz_id, user):
+    """Return (rank, best_score) for a user, or (None, None) without attempts."""
+    best_score = (
+        QuizAttemptState.objects.filter(quiz_id=quiz_id, user=user)
+        .values_list("best_score", flat=True)
+        .first()
+    )
+    if best_score is None:
+        return None, None
+    ahead = QuizAttemptState.objects.filter(
+        quiz_id=quiz_id, best_score__gt=best_score
+    ).count()
+    return ahead + 1, best_score
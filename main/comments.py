@@ -0,0 +1,179 @@
+from collections import defaultdict
+from django.contrib.auth.models import Group
+from django.db.models import Count, Exists, F, FilteredRelation, OuterRef, Q
+from django.utils import timezone
+from main.models import AchieveUser, Comment, CourseEnrollment, LessonReadMarker
+from main.utils import paginate_keyset
+
+# Read side of the discussion forum. A lesson's visible comments are fetched in
+# one query (plus one for images), indexed by reply_to_id in a dict and turned
+# into threads in memory, nothing is ever written while reading. The only thing
+# written here is the answered flag of threads, when replies come and go, and
+# the read markers behind the unread counts.
+
+
+def commentor_is_editor():
+    """Q matching comments written by staff or instructors."""
+    instructor_membership = AchieveUser.groups.through.objects.filter(
+        achieveuser_id=OuterRef("commentor_id"),
+        group__in=Group.objects.filter(name="Instructors"),
+    )
+    return Q(commentor__is_staff=True) | Q(Exists(instructor_membership))
+
+
+def visible_comments(user, is_editor):
+    """Comments a user may read: everything for editors, otherwise the user's own
+    threads (their comments and the replies to them) and the broadcasts."""
+    comments = Comment.objects.all()
+    if is_editor:
+        return comments
+    return comments.filter(
+        Q(commentor=user, reply_to=None)
+        | Q(reply_to__commentor=user, reply_to__reply_to=None)
+        | (Q(reply_to=None) & commentor_is_editor())
+    )
+
+
+def get_lesson_comments(lesson_id, user, is_editor):
+    comments = list(
+        visible_comments(user, is_editor)
+        .filter(lesson_id=lesson_id)
+        .select_related("commentor")
+        .prefetch_related("images")
+        .order_by("commented_at", "id")
+    )
+    children = defaultdict(list)
+    for comment in comments:
+        if comment.reply_to_id is not None:
+            children[comment.reply_to_id].append(comment.id)
+    # Read by CommentSerializer instead of querying comment.replies
+    for comment in comments:
+        comment.reply_ids = children[comment.id]
+    return comments
+
+
+def nest_comments(serialized_comments):
+    """Turn a flat list of serialized comments into threads with nested replies."""
+    by_id = {
+        comment["id"]: {**comment, "replies": []} for comment in serialized_comments
+    }
+    threads = []
+    for comment in by_id.values():
+        parent = by_id.get(comment["reply_to_id"])
+        if parent is not None:
+            parent["replies"].append(comment)
+        elif comment["reply_to_id"] is None:
+            threads.append(comment)
+    return threads
+
+
+def get_thread_page(lesson_id, user, is_editor, cursor, limit):
+    """One page of a lesson's top-level comments, newest first, with reply counts."""
+    threads = (
+        visible_comments(user, is_editor)
+        .filter(lesson_id=lesson_id, reply_to=None)
+        .select_related("commentor")
+        .prefetch_related("images")
+        .annotate(reply_count=Count("replies"))
+    )
+    threads, next_cursor = paginate_keyset(threads, "commented_at", cursor, limit)
+    for thread in threads:
+        # Students only see the replies of their own threads
+        if not is_editor and thread.commentor_id != user.id:
+            thread.reply_count = 0
+    return threads, next_cursor
+
+
+def get_thread_replies(comment_id, user, is_editor, cursor, limit):
+    """One page of the replies to a visible top-level comment, oldest first.
+
+    Returns (None, None) when the thread does not exist or is not visible.
+    """
+    if not (
+        visible_comments(user, is_editor).filter(id=comment_id, reply_to=None).exists()
+    ):
+        return None, None
+    replies = (
+        visible_comments(user, is_editor)
+        .filter(reply_to_id=comment_id)
+        .select_related("commentor")
+        .prefetch_related("images")
+    )
+    replies, next_cursor = paginate_keyset(
+        replies, "commented_at", cursor, limit, descending=False
+    )
+    for reply in replies:
+        reply.reply_ids = []
+    return replies, next_cursor
+
+
+def mark_answered(comment_id):
+    """Flag a thread as answered after an editor replied to it."""
+    Comment.objects.filter(id=comment_id, reply_to=None, answered=False).update(
+        answered=True
+    )
+
+
+def refresh_answered(comment_ids):
+    """Recompute the answered flag of threads, e.g. after a reply was deleted."""
+    editor_replies = Comment.objects.filter(reply_to=OuterRef("pk")).filter(
+        commentor_is_editor()
+    )
+    # Editors' own threads stay answered
+    Comment.objects.filter(id__in=comment_ids, reply_to=None).exclude(
+        commentor_is_editor()
+    ).update(answered=Exists(editor_replies))
+
+
+def unanswered_comments(user):
+    """Threads without an editor reply in the courses a user teaches.
+
+    Staff see every course, instructors the courses they created or are
+    enrolled in.
+    """
+    comments = Comment.objects.filter(reply_to=None, answered=False)
+    if not user.is_staff:
+        comments = comments.filter(
+            Q(lesson__course__creator=user)
+            | Q(
+                lesson__course__in=CourseEnrollment.objects.filter(user=user).values(
+                    "course_id"
+                )
+            )
+        )
+    return comments.select_related("commentor", "lesson").prefetch_related("images")
+
+
+def get_unread_counts(course_id, user, is_editor):
+    """Return {lesson_id: unread comments} for the lessons of a course, in one query.
+
+    Unread comments are the visible comments of others posted after the
+    user's read marker of the lesson (all of them without a marker). Lessons
+    without unread comments are left out.
+    """
+    return dict(
+        visible_comments(user, is_editor)
+        .filter(lesson__course_id=course_id)
+        .exclude(commentor=user)
+        .annotate(
+            marker=FilteredRelation(
+                "lesson__read_markers", condition=Q(lesson__read_markers__user=user)
+            )
+        )
+        .filter(
+            Q(marker__last_read_at=None) | Q(commented_at__gt=F("marker__last_read_at"))
+        )
+        .order_by()
+        .values("lesson_id")
+        .annotate(unread=Count("id"))
+        .values_list("lesson_id", "unread")
+    )
+
+
+def mark_lesson_read(lesson_id, user):
+    LessonReadMarker.objects.bulk_create(
+        [LessonReadMarker(lesson_id=lesson_id, user=user, last_read_at=timezone.now())],
+        update_conflicts=True,
+        unique_fields=["lesson", "user"],
+        update_fields=["last_read_at"],
+    )
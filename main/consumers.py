@@ -8,6 +8,7 @@ from jwt import decode as jwt_decode
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
 from django.conf import settings
 from rest_framework_simplejwt.tokens import UntypedToken
+from main.roles import INSTRUCTORS, STUDENTS, get_roles
 
 logger = logging.getLogger(__name__)
 
@@ -42,13 +43,8 @@ def get_user_from_token(token):
         return AnonymousUser
 
 
-@database_sync_to_async
-def user_is_instructor(user):
-    return user.groups.filter(name="Instructors").exists()
-
-@database_sync_to_async
-def user_is_student(user):
-    return user.groups.filter(name="Students").exists()
+# Roles are resolved once per connection and kept on the user in the scope
+get_user_roles = database_sync_to_async(get_roles)
 
 
 class AppConsumer(AsyncWebsocketConsumer):
@@ -74,11 +70,12 @@ class AppConsumer(AsyncWebsocketConsumer):
                 await self.channel_layer.group_add(
                     self.private_group_name, self.channel_name
                 )
-                if self.scope["user"].is_staff or await user_is_instructor(user):
+                user_roles = await get_user_roles(user)
+                if user.is_staff or INSTRUCTORS in user_roles:
                     await self.channel_layer.group_add(
                         self.can_edit_group_name, self.channel_name
                     )
-                elif await user_is_student(user):
+                elif STUDENTS in user_roles:
                     await self.channel_layer.group_add(
                         self.students_group_name, self.channel_name
                     )
@@ -129,6 +126,11 @@ class AppConsumer(AsyncWebsocketConsumer):
         """Handle notification sent."""
         await self.send_event("notification", event.get("message", ""))
 
+    # NOTIFICATION DIGEST
+    async def notification_digest(self, event):
+        """Handle notification_digest sent."""
+        await self.send_event("notification_digest", event.get("message", ""))
+
     # PRIVATE POOL
     async def private_message(self, event):
         """Handle messages sent to the private group."""
@@ -0,0 +1,257 @@
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from main.models import CommentFanout, Notification
+from main.notifications import save_notifications
+from main.roles import is_editor, is_student
+from main.search import comment_document, index_documents
+from main.serializers import CommentSerializer, NotificationSerializer
+from main.utils import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# Side effects of a new comment. AddCommentView only records a CommentFanout row
+# next to the comment, the dispatcher below resolves who has to be told, saves
+# the notifications (coalesced with recent ones, see main/notifications.py),
+# indexes the comment for search and sends the WebSocket events after its own
+# commit. It runs in a background thread of the
+# web process right after the comment is committed and from the
+# dispatch_comment_fanout command, which also picks up anything a crashed
+# process left behind.
+
+MAX_ATTEMPTS = 5
+
+
+def record_comment_fanout(comment):
+    """Queue the notifications of a new comment, inside the caller's transaction."""
+    CommentFanout.objects.create(comment=comment)
+    if settings.COMMENT_FANOUT_IN_PROCESS:
+        transaction.on_commit(lambda: run_in_background(dispatch_pending_fanouts))
+
+
+def plan_comment_fanout(comment):
+    """Return (notifications, events) for a new comment.
+
+    notifications are unsaved Notification objects paired with the channel
+    group they are pushed to, events are (group, message) pairs.
+    """
+    commentor = comment.commentor
+    name = commentor.first_name
+    serialized = CommentSerializer(comment).data
+    notifications = []
+    events = []
+
+    if comment.reply_to_id is not None:
+        parent = comment.reply_to
+        reciever = parent.commentor
+        lesson = parent.lesson.module_title
+        # a student might reply to himself and that would create a duplication
+        if reciever.id != commentor.id:
+            if is_student(reciever):
+                private_group_name = f"user_{reciever.id}"
+                events.append(
+                    (
+                        private_group_name,
+                        {"type": "comment_created", "message": serialized},
+                    )
+                )
+                notifications.append(
+                    (
+                        Notification(
+                            kind=Notification.REPLY,
+                            reciever=reciever,
+                            lesson=parent.lesson,
+                            message=f"{name} replied to your comment in lesson {lesson}",
+                            comment_id=comment.reply_to_id,
+                        ),
+                        private_group_name,
+                    )
+                )
+            elif is_editor(reciever):
+                notifications.append(
+                    (
+                        Notification(
+                            kind=Notification.REPLY,
+                            reciever=reciever,
+                            lesson=parent.lesson,
+                            message=f"{name} replied to you in lesson  {lesson}",
+                            comment_id=comment.reply_to_id,
+                        ),
+                        "Editors",
+                    )
+                )
+
+    is_broadcast = False
+    if not is_editor(commentor):
+        events.append(
+            (f"user_{commentor.id}", {"type": "comment_created", "message": serialized})
+        )
+        if comment.reply_to_id is None:
+            notifications.append(
+                (
+                    Notification(
+                        kind=Notification.STUDENT_COMMENT,
+                        audience=Notification.EDITORS,
+                        course_id=comment.lesson.course_id,
+                        lesson=comment.lesson,
+                        message="A student left a comment",
+                        comment_id=comment.id,
+                    ),
+                    "Editors",
+                )
+            )
+    elif comment.reply_to_id is None:
+        is_broadcast = True
+        events.append(("Students", {"type": "comment_created", "message": serialized}))
+        notifications.append(
+            (
+                Notification(
+                    kind=Notification.BROADCAST,
+                    audience=Notification.STUDENTS,
+                    course_id=comment.lesson.course_id,
+                    lesson_id=comment.lesson_id,
+                    message=f"{name} added a new broadcast to lesson {comment.lesson_id}",
+                    comment_id=comment.id,
+                ),
+                "Students",
+            )
+        )
+
+    events.append(("Editors", {"type": "comment_created", "message": serialized}))
+    if is_broadcast:
+        notifications.append(
+            (
+                Notification(
+                    kind=Notification.BROADCAST,
+                    audience=Notification.EDITORS,
+                    course_id=comment.lesson.course_id,
+                    message=f"A new broadcast has been added to lesson {comment.lesson_id}",
+                    lesson_id=comment.lesson_id,
+                    comment_id=comment.id,
+                ),
+                "Editors",
+            )
+        )
+    return notifications, events
+
+
+def send_events(events):
+    channel_layer = get_channel_layer()
+    for group, message in events:
+        async_to_sync(channel_layer.group_send)(group, message)
+
+
+def plan_fanout(fanout):
+    """Return (notifications, events, document) of a fan-out's comment."""
+    comment = fanout.comment
+    # A new comment has no replies yet
+    comment.reply_ids = []
+    notifications, events = plan_comment_fanout(comment)
+    document = comment_document(comment, is_editor(comment.commentor))
+    return notifications, events, document
+
+
+def save_fanouts(plans):
+    """Save the notifications and search documents of planned fan-outs.
+
+    Returns the events to send once the transaction commits.
+    """
+    notifications = []
+    events = []
+    documents = []
+    for planned, planned_events, document in plans:
+        notifications += planned
+        events += planned_events
+        documents.append(document)
+    index_documents(documents)
+    return events + [
+        (
+            group,
+            {
+                "type": "notification",
+                "message": NotificationSerializer(notification).data,
+            },
+        )
+        for notification, group in save_notifications(notifications)
+        if not notification.digest_pending
+    ]
+
+
+def fail_fanout(fanout, error, failed_ids):
+    logger.exception("Comment fan-out %s failed", fanout.id)
+    fanout.last_error = str(error)
+    failed_ids.append(fanout.id)
+
+
+def dispatch_pending_fanouts(batch_size=100):
+    """Dispatch queued comment fan-outs until none are left.
+
+    Rows are claimed with SKIP LOCKED so several dispatchers can run at once.
+    A fan-out that fails is retried by a later run, not by this one. Returns
+    the number of fan-outs dispatched.
+    """
+    dispatched = 0
+    failed_ids = []
+    while True:
+        with transaction.atomic():
+            fanouts = list(
+                CommentFanout.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(dispatched_at=None, attempts__lt=MAX_ATTEMPTS)
+                .exclude(id__in=failed_ids)
+                .select_related(
+                    "comment__commentor",
+                    "comment__lesson",
+                    "comment__reply_to__commentor",
+                    "comment__reply_to__lesson",
+                )
+                .prefetch_related(
+                    "comment__images",
+                    "comment__commentor__groups",
+                    "comment__reply_to__commentor__groups",
+                )
+                .order_by("created_at")[:batch_size]
+            )
+            if not fanouts:
+                return dispatched
+
+            planned = []
+            for fanout in fanouts:
+                fanout.attempts += 1
+                try:
+                    planned.append((fanout, plan_fanout(fanout)))
+                except Exception as e:
+                    fail_fanout(fanout, e, failed_ids)
+
+            try:
+                # In a savepoint, so a failure leaves the attempts to record
+                with transaction.atomic():
+                    events = save_fanouts([plan for _, plan in planned])
+            except Exception:
+                logger.exception("Comment fan-out batch failed, retrying one by one")
+                # Find the fan-outs that break the batch, planning again as
+                # the first pass may have folded notifications together
+                events = []
+                for fanout, _ in planned:
+                    try:
+                        with transaction.atomic():
+                            events += save_fanouts([plan_fanout(fanout)])
+                    except Exception as e:
+                        fail_fanout(fanout, e, failed_ids)
+            for fanout, _ in planned:
+                if fanout.id not in failed_ids:
+                    fanout.dispatched_at = timezone.now()
+            CommentFanout.objects.bulk_update(
+                fanouts, ["attempts", "dispatched_at", "last_error"]
+            )
+            transaction.on_commit(lambda events=events: send_events(events))
+
+        for fanout in fanouts:
+            if fanout.dispatched_at is not None:
+                dispatched += 1
+                latency = (fanout.dispatched_at - fanout.created_at).total_seconds()
+                logger.info(
+                    "Comment fan-out %s dispatched after %.3fs", fanout.id, latency
+                )
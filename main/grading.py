@@ -0,0 +1,291 @@
+from collections import defaultdict
+from functools import lru_cache
+from types import MappingProxyType
+from typing import NamedTuple
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Max, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from rest_framework import serializers
+from main.analytics import reset_quiz_stats
+from main.models import Quiz, Question, QuizAttempt, QuizAttemptState, Answer
+
+
+# Quiz grading: every quiz is compiled once per version into an immutable
+# answer key kept in an in-process LRU, so grading a submission is a pure CPU
+# operation and the number of statements per submission does not depend on
+# how many questions the quiz has.
+
+
+class AnswerKeyEntry(NamedTuple):
+    correct_answer: str
+    points: int
+    question_type: str
+
+
+class AnswerKey(NamedTuple):
+    quiz_id: int
+    version: int
+    entries: MappingProxyType  # {question_id: AnswerKeyEntry}
+
+
+def normalize_answer(answer_text, question_type):
+    if answer_text is None:
+        return None
+    answer_text = answer_text.strip()
+    if question_type == "TF":
+        return answer_text.casefold()
+    return answer_text
+
+
+@lru_cache(maxsize=settings.QUIZ_ANSWER_KEY_CACHE_SIZE)
+def get_answer_key(quiz_id, version):
+    """Compile the answer key of a quiz at a given version.
+
+    Keys are cached per (quiz_id, version): editing a quiz bumps its version so
+    stale keys are never looked up again and simply age out of the LRU.
+    """
+    entries = {
+        question_id: AnswerKeyEntry(
+            normalize_answer(correct_answer, question_type),
+            question_point,
+            question_type,
+        )
+        for question_id, correct_answer, question_point, question_type in (
+            Question.objects.filter(quiz_id=quiz_id)
+            .order_by("id")
+            .values_list("id", "correct_answer", "question_point", "question_type")
+        )
+    }
+    return AnswerKey(quiz_id, version, MappingProxyType(entries))
+
+
+def get_current_answer_key(quiz_id):
+    version = Quiz.objects.values_list("version", flat=True).get(id=quiz_id)
+    return get_answer_key(quiz_id, version)
+
+
+def is_correct_answer(entry, answer_text):
+    return normalize_answer(answer_text, entry.question_type) == entry.correct_answer
+
+
+def grade_answers(answer_key, answers):
+    """Score submitted answers against an answer key without touching the database.
+
+    Returns (score, graded) where graded is a list of
+    (question_id, answer_text, is_correct) tuples in submission order.
+    """
+    entries = answer_key.entries
+    unknown = [
+        answer["question_id"]
+        for answer in answers
+        if answer["question_id"] not in entries
+    ]
+    if unknown:
+        raise serializers.ValidationError(
+            {"error": f"Questions {unknown} do not belong to this quiz"}
+        )
+    seen = set()
+    duplicates = []
+    for answer in answers:
+        question_id = answer["question_id"]
+        if question_id in seen and question_id not in duplicates:
+            duplicates.append(question_id)
+        seen.add(question_id)
+    if duplicates:
+        raise serializers.ValidationError(
+            {"error": f"Questions {duplicates} are answered more than once"}
+        )
+
+    score = 0
+    graded = []
+    for answer in answers:
+        question_id = answer["question_id"]
+        answer_text = answer.get("answer_text")
+        entry = entries[question_id]
+        is_correct = is_correct_answer(entry, answer_text)
+        if is_correct:
+            score += entry.points
+        graded.append((question_id, answer_text, is_correct))
+    return score, graded
+
+
+def submit_attempt(quiz_id, taken_by, answers):
+    version, attempts_allowed = Quiz.objects.values_list(
+        "version", "attempts_allowed"
+    ).get(id=quiz_id)
+    score, graded = grade_answers(get_answer_key(quiz_id, version), answers)
+
+    # The score is known before anything is written, so the attempt is inserted
+    # once and its answers follow in a single bulk insert.
+    with transaction.atomic():
+        state, _ = QuizAttemptState.objects.select_for_update().get_or_create(
+            quiz_id=quiz_id, user=taken_by
+        )
+        # The limit is checked by the same UPDATE that takes the attempt
+        states = QuizAttemptState.objects.filter(pk=state.pk)
+        if attempts_allowed:
+            states = states.filter(attempts_taken__lt=attempts_allowed)
+        taken = states.update(
+            attempts_taken=F("attempts_taken") + 1,
+            best_score=Greatest(F("best_score"), Value(score)),
+            best_scored_at=Case(
+                When(
+                    Q(best_score__lt=score) | Q(best_scored_at=None),
+                    then=Value(timezone.now()),
+                ),
+                default=F("best_scored_at"),
+            ),
+        )
+        if not taken:
+            raise serializers.ValidationError(
+                {"error": "No attempts left for this quiz"}
+            )
+        if settings.QUIZ_COMPACT_ANSWERS:
+            # One row per attempt, the answers are packed on it
+            return QuizAttempt.objects.create(
+                quiz_id=quiz_id,
+                taken_by=taken_by,
+                total_attempts=state.attempts_taken + 1,
+                score=score,
+                quiz_version=version,
+                packed_answers=[list(answer) for answer in graded],
+            )
+        attempt = QuizAttempt.objects.create(
+            quiz_id=quiz_id,
+            taken_by=taken_by,
+            total_attempts=state.attempts_taken + 1,
+            score=score,
+            quiz_version=version,
+        )
+        Answer.objects.bulk_create(
+            [
+                Answer(
+                    question_id=question_id,
+                    answer_text=answer_text,
+                    is_correct=is_correct,
+                    attempt=attempt,
+                )
+                for question_id, answer_text, is_correct in graded
+            ]
+        )
+    return attempt
+
+
+def unpack_answers(attempt):
+    """Return the answers of an attempt as dicts, from either storage mode."""
+    if attempt.packed_answers is not None:
+        return [
+            {
+                "id": None,
+                "answer_text": answer_text,
+                "question_id": question_id,
+                "is_correct": is_correct,
+            }
+            for question_id, answer_text, is_correct in attempt.packed_answers
+        ]
+    return list(
+        Answer.objects.filter(attempt=attempt)
+        .order_by("id")
+        .values("id", "answer_text", "question_id", "is_correct")
+    )
+
+
+def regrade_packed_answers(answer_key, packed_answers):
+    score = 0
+    regraded = []
+    for question_id, answer_text, _ in packed_answers:
+        entry = answer_key.entries.get(question_id)
+        is_correct = entry is not None and is_correct_answer(entry, answer_text)
+        if is_correct:
+            score += entry.points
+        regraded.append([question_id, answer_text, is_correct])
+    return score, regraded
+
+
+def recompute_best_scores(quiz_id):
+    attempts = QuizAttempt.objects.filter(
+        quiz_id=quiz_id, taken_by_id=OuterRef("user_id")
+    )
+    states = QuizAttemptState.objects.filter(quiz_id=quiz_id)
+    states.update(
+        best_score=Coalesce(
+            Subquery(
+                attempts.values("taken_by_id")
+                .annotate(best=Max("score"))
+                .values("best")[:1]
+            ),
+            0,
+        )
+    )
+    states.update(
+        best_scored_at=Subquery(
+            attempts.filter(score=OuterRef("best_score"))
+            .order_by("taken_at")
+            .values("taken_at")[:1]
+        )
+    )
+
+
+def regrade_quiz(quiz_id, batch_size=1000):
+    """Re-score every attempt of a quiz against its current answer key.
+
+    Used after an instructor fixes a wrong correct answer. Returns the number
+    of attempts whose score changed.
+    """
+    answer_key = get_current_answer_key(quiz_id)
+    scores = defaultdict(int)
+    changed_answers = []
+
+    with transaction.atomic():
+        answers = (
+            Answer.objects.filter(attempt__quiz_id=quiz_id)
+            .only("id", "attempt_id", "question_id", "answer_text", "is_correct")
+            .iterator(chunk_size=batch_size)
+        )
+        for answer in answers:
+            entry = answer_key.entries.get(answer.question_id)
+            is_correct = entry is not None and is_correct_answer(
+                entry, answer.answer_text
+            )
+            scores[answer.attempt_id] += entry.points if is_correct else 0
+            if answer.is_correct != is_correct:
+                answer.is_correct = is_correct
+                changed_answers.append(answer)
+            if len(changed_answers) >= batch_size:
+                Answer.objects.bulk_update(changed_answers, ["is_correct"])
+                changed_answers = []
+        Answer.objects.bulk_update(changed_answers, ["is_correct"])
+
+        changed_attempts = []
+        rescored = 0
+        attempts = (
+            QuizAttempt.objects.filter(quiz_id=quiz_id)
+            .only("id", "score", "packed_answers")
+            .iterator(chunk_size=batch_size)
+        )
+        for attempt in attempts:
+            # A key change can flip answers without changing the total, the
+            # packed flags are saved whenever any of them changed
+            packed_changed = False
+            if attempt.packed_answers is not None:
+                score, packed_answers = regrade_packed_answers(
+                    answer_key, attempt.packed_answers
+                )
+                packed_changed = packed_answers != attempt.packed_answers
+                attempt.packed_answers = packed_answers
+            else:
+                score = scores.get(attempt.id, 0)
+            if attempt.score != score:
+                attempt.score = score
+                rescored += 1
+                changed_attempts.append(attempt)
+            elif packed_changed:
+                changed_attempts.append(attempt)
+        QuizAttempt.objects.bulk_update(
+            changed_attempts, ["score", "packed_answers"], batch_size=batch_size
+        )
+        recompute_best_scores(quiz_id)
+        reset_quiz_stats(quiz_id)
+    return rescored
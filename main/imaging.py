@@ -0,0 +1,82 @@
+from io import BytesIO
+from PIL import Image, ImageOps, features
+
+# Resizing of uploaded images. This module only depends on Pillow so it can be
+# imported by the worker processes of main/media.py without setting up Django.
+
+# What Pillow raises for files it cannot decode (UnidentifiedImageError and
+# truncated files are OSErrors)
+DECODE_ERRORS = (OSError, ValueError, SyntaxError, Image.DecompressionBombError)
+
+# Longest side, in pixels, of each variant
+VARIANT_SIZES = {"thumbnail": 320, "display": 1280}
+VARIANT_QUALITY = 80
+# Formats the stripped original keeps, anything else is stored as a variant
+ORIGINAL_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+ORIGINAL_QUALITY = 90
+
+
+def variant_format():
+    """Return (Pillow format, file extension) used for the variants."""
+    if features.check("webp"):
+        return "WEBP", "webp"
+    return "JPEG", "jpg"
+
+
+def render_variants(data):
+    """Render the resized variants of an encoded image.
+
+    Returns {"width", "height", "extension", "variants": {name: bytes},
+    "original": bytes, "original_extension"}. The variants and the full size
+    original are re-encoded from the pixels only, so EXIF, GPS and other
+    metadata of the upload are not carried over.
+    """
+    image_format, extension = variant_format()
+    with Image.open(BytesIO(data)) as image:
+        original_format = image.format
+        # Phones store the orientation in EXIF instead of rotating the pixels
+        image = ImageOps.exif_transpose(image)
+        width, height = image.size
+        original, original_extension = strip_metadata(
+            image, original_format, image_format, extension
+        )
+        has_alpha = image.mode in ("RGBA", "LA") or "transparency" in image.info
+        if image_format == "JPEG" or not has_alpha:
+            image = image.convert("RGB")
+        else:
+            image = image.convert("RGBA")
+
+        variants = {}
+        for name, size in VARIANT_SIZES.items():
+            variant = image.copy()
+            variant.thumbnail((size, size), Image.Resampling.LANCZOS)
+            output = BytesIO()
+            variant.save(output, image_format, quality=VARIANT_QUALITY, optimize=True)
+            variants[name] = output.getvalue()
+    return {
+        "width": width,
+        "height": height,
+        "extension": extension,
+        "variants": variants,
+        "original": original,
+        "original_extension": original_extension,
+    }
+
+
+def strip_metadata(image, original_format, variant_format, variant_extension):
+    """Return (bytes, extension) of image at full size, without its metadata."""
+    if original_format in ORIGINAL_FORMATS:
+        image_format = original_format
+        extension = ORIGINAL_FORMATS[original_format]
+    else:
+        image_format, extension = variant_format, variant_extension
+    # Only the pixels are copied, image.info (EXIF, XMP, ICC, text chunks)
+    # stays behind
+    clean = Image.frombytes(image.mode, image.size, image.tobytes())
+    if image.mode == "P":
+        clean.putpalette(image.getpalette(rawmode="RGBA"), rawmode="RGBA")
+    if image_format == "JPEG" and clean.mode not in ("RGB", "L", "CMYK"):
+        clean = clean.convert("RGB")
+    output = BytesIO()
+    clean.save(output, image_format, quality=ORIGINAL_QUALITY)
+    return output.getvalue(), extension
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from main.analytics import refresh_stale_quiz_stats
+
+
+class Command(BaseCommand):
+    help = "Fold new quiz attempts into the per-quiz and per-question statistics."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        refreshed = refresh_stale_quiz_stats(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed stats of {refreshed} quizzes"))
@@ -0,0 +1,61 @@
+import gzip
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+from main.notifications import archive_notifications
+
+
+class Command(BaseCommand):
+    help = "Move old notifications out of the database into a gzipped JSON lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=settings.NOTIFICATION_RETENTION_DAYS,
+            help="Archive notifications older than DAYS days.",
+        )
+        parser.add_argument(
+            "--seen",
+            action="store_true",
+            help="Also archive personal notifications their receiver has seen.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0.5,
+            help="Seconds to wait between batches.",
+        )
+        parser.add_argument(
+            "--archive-dir", default=str(settings.NOTIFICATION_ARCHIVE_DIR)
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        os.makedirs(options["archive_dir"], exist_ok=True)
+        path = os.path.join(
+            options["archive_dir"],
+            f"notifications-{now.strftime('%Y%m%dT%H%M%S%f')}.jsonl.gz",
+        )
+        with gzip.open(path, "wb") as out:
+            rows, archived_bytes = archive_notifications(
+                out,
+                now - timedelta(days=options["days"]),
+                seen=options["seen"],
+                batch_size=options["batch_size"],
+                pause=options["pause"],
+            )
+        if not rows:
+            os.remove(path)
+            self.stdout.write(self.style.SUCCESS("No notifications to archive"))
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Archived {rows} notifications ({filesizeformat(archived_bytes)}) "
+                f"to {path} ({filesizeformat(os.path.getsize(path))})"
+            )
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from main.media import collect_deleted_media
+
+
+class Command(BaseCommand):
+    help = "Remove the files of deleted comments from storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        removed = collect_deleted_media(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Removed {removed} files"))
@@ -0,0 +1,26 @@
+import time
+from django.core.management.base import BaseCommand
+from main.fanout import dispatch_pending_fanouts
+
+
+class Command(BaseCommand):
+    help = "Send the notifications and WebSocket events of newly posted comments."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep running and poll for new comments every INTERVAL seconds.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            dispatched = dispatch_pending_fanouts(batch_size=options["batch_size"])
+            self.stdout.write(
+                self.style.SUCCESS(f"Dispatched {dispatched} comment fan-outs")
+            )
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
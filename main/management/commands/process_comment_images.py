@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from main.media import process_comment_images
+
+
+class Command(BaseCommand):
+    help = "Render the thumbnail and display variants of new comment images."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=32)
+
+    def handle(self, *args, **options):
+        processed = process_comment_images(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} images"))
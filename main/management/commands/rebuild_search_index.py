@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from main.models import Comment, Course, Flashcard, Module
+from main.roles import is_editor
+from main.search import (
+    comment_document,
+    course_document,
+    flashcard_document,
+    index_documents,
+    lesson_document,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite the search documents of every course, lesson, flashcard and comment."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def index(self, queryset, to_document, batch_size):
+        count = 0
+        documents = []
+        for row in queryset.order_by("id").iterator(chunk_size=batch_size):
+            documents.append(to_document(row))
+            if len(documents) >= batch_size:
+                index_documents(documents)
+                count += len(documents)
+                documents = []
+        index_documents(documents)
+        return count + len(documents)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        count = self.index(Course.objects.all(), course_document, batch_size)
+        count += self.index(Module.objects.all(), lesson_document, batch_size)
+        count += self.index(
+            Flashcard.objects.select_related("lesson"), flashcard_document, batch_size
+        )
+        count += self.index(
+            Comment.objects.select_related(
+                "commentor", "lesson", "reply_to"
+            ).prefetch_related("commentor__groups"),
+            lambda comment: comment_document(comment, is_editor(comment.commentor)),
+            batch_size,
+        )
+        self.stdout.write(self.style.SUCCESS(f"Indexed {count} documents"))
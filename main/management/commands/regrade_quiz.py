@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+from main.grading import regrade_quiz
+from main.models import Quiz
+
+
+class Command(BaseCommand):
+    help = "Re-score all attempts of a quiz against its current answer key."
+
+    def add_arguments(self, parser):
+        parser.add_argument("quiz_id", type=int)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        try:
+            changed = regrade_quiz(options["quiz_id"], batch_size=options["batch_size"])
+        except Quiz.DoesNotExist:
+            raise CommandError(f"Quiz {options['quiz_id']} does not exist")
+        self.stdout.write(self.style.SUCCESS(f"Re-graded quiz, {changed} scores changed"))
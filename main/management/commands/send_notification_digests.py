@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from main.notifications import send_notification_digests
+
+
+class Command(BaseCommand):
+    help = "Push the notifications held back for the digest (NOTIFICATION_DIGEST)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=0,
+            help="Keep running and send a digest every INTERVAL seconds.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            sent = send_notification_digests(batch_size=options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(f"Sent {sent} notifications"))
+            if not options["interval"]:
+                return
+            time.sleep(options["interval"])
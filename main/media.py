@@ -0,0 +1,180 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from main.imaging import DECODE_ERRORS, render_variants
+from main.models import CommentImage, PendingMediaDeletion
+from main.utils import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# Background work on uploaded files, nothing here runs inside a request.
+#
+# Comment images: the upload is stored as is and the request returns, the
+# thumbnail and display variants are then rendered in a pool of worker
+# processes (encoding is CPU bound) by a background thread of the web process
+# and by the process_comment_images command. The upload itself is then
+# replaced by a full size copy without its EXIF, GPS and other metadata, the
+# API does not serve it before that.
+#
+# Garbage collection: deleting a comment only queues its file paths, they are
+# unlinked here in batches, after a delete and from the collect_deleted_media
+# command.
+
+_image_pool = None
+
+
+def _get_image_pool():
+    global _image_pool
+    if _image_pool is None:
+        # Workers are spawned, not forked, so they don't inherit the database
+        # connections and threads of the web process
+        _image_pool = ProcessPoolExecutor(
+            max_workers=settings.COMMENT_IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _image_pool
+
+
+def _reset_image_pool():
+    # A worker died (e.g. killed for its memory use), a broken pool fails every
+    # later submission so it is replaced
+    global _image_pool
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+        _image_pool = None
+
+
+def _submit(data):
+    try:
+        return _get_image_pool().submit(render_variants, data)
+    except BrokenProcessPool:
+        logger.warning("Image worker pool is broken, starting a new one")
+        _reset_image_pool()
+        return _get_image_pool().submit(render_variants, data)
+
+
+def schedule_image_processing(image_ids):
+    """Render the variants of new images once the caller's transaction commits."""
+    if image_ids and settings.COMMENT_IMAGE_PROCESSING_IN_PROCESS:
+        transaction.on_commit(
+            lambda: run_in_background(process_comment_images, image_ids)
+        )
+
+
+def _read(file):
+    with file.open("rb") as f:
+        return f.read()
+
+
+def process_comment_images(image_ids=None, batch_size=32):
+    """Render the variants of unprocessed comment images.
+
+    Only the given images are processed when image_ids is set. Returns the
+    number of images processed.
+    """
+    images = (
+        CommentImage.objects.filter(width=None).exclude(image="").exclude(image=None)
+    )
+    if image_ids is not None:
+        images = images.filter(id__in=image_ids)
+    images = list(images.only("id", "image").order_by("id"))
+
+    for start in range(0, len(images), batch_size):
+        batch = images[start : start + batch_size]
+        futures = []
+        for image in batch:
+            try:
+                futures.append((image, _submit(_read(image.image))))
+            except OSError:
+                # Left unprocessed, a later run tries again
+                logger.exception("Could not read comment image %s", image.id)
+
+        rendered = []
+        replaced = []
+        broken = False
+        for image, future in futures:
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                logger.exception("Worker died resizing comment image %s", image.id)
+                broken = True
+                continue
+            except DECODE_ERRORS:
+                # Not an image Pillow can read, don't try again
+                logger.exception("Could not decode comment image %s", image.id)
+                image.width = image.height = 0
+                rendered.append(image)
+                continue
+            except Exception:
+                logger.exception("Could not resize comment image %s", image.id)
+                continue
+            base_name = os.path.splitext(os.path.basename(image.image.name))[0]
+            for name, data in result["variants"].items():
+                getattr(image, name).save(
+                    f"{base_name}.{result['extension']}", ContentFile(data), save=False
+                )
+            # The upload is replaced by a copy without its metadata
+            replaced.append(image.image.name)
+            image.image.save(
+                f"{base_name}.{result['original_extension']}",
+                ContentFile(result["original"]),
+                save=False,
+            )
+            image.width = result["width"]
+            image.height = result["height"]
+            rendered.append(image)
+        if broken:
+            _reset_image_pool()
+
+        CommentImage.objects.bulk_update(
+            rendered, ["image", "thumbnail", "display", "width", "height"]
+        )
+        # The comment may have been deleted while its images were rendered
+        kept = set(
+            CommentImage.objects.filter(
+                id__in=[image.id for image in rendered]
+            ).values_list("id", flat=True)
+        )
+        PendingMediaDeletion.objects.bulk_create(
+            [PendingMediaDeletion(path=path) for path in replaced]
+            + [
+                PendingMediaDeletion(path=file.name)
+                for image in rendered
+                if image.id not in kept
+                for file in (image.image, image.thumbnail, image.display)
+                if file
+            ]
+        )
+    return len(images)
+
+
+def collect_deleted_media(batch_size=500):
+    """Remove queued files from storage until the queue is empty.
+
+    Returns the number of files removed.
+    """
+    removed = 0
+    while True:
+        with transaction.atomic():
+            pending = list(
+                PendingMediaDeletion.objects.select_for_update(
+                    skip_locked=True
+                ).order_by("id")[:batch_size]
+            )
+            if not pending:
+                return removed
+            for deletion in pending:
+                try:
+                    default_storage.delete(deletion.path)
+                except OSError as e:
+                    logger.warning("Could not delete %s: %s", deletion.path, e)
+            PendingMediaDeletion.objects.filter(
+                id__in=[deletion.id for deletion in pending]
+            ).delete()
+        removed += len(pending)
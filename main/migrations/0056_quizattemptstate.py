@@ -0,0 +1,51 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_attempt_states(apps, schema_editor):
+    QuizAttempt = apps.get_model("main", "QuizAttempt")
+    QuizAttemptState = apps.get_model("main", "QuizAttemptState")
+    counts = (
+        QuizAttempt.objects.values("quiz_id", "taken_by_id")
+        .annotate(attempts_taken=Count("id"))
+        .order_by()
+    )
+    QuizAttemptState.objects.bulk_create(
+        (
+            QuizAttemptState(
+                quiz_id=row["quiz_id"],
+                user_id=row["taken_by_id"],
+                attempts_taken=row["attempts_taken"],
+            )
+            for row in counts.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0055_quiz_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizAttemptState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts_taken', models.PositiveIntegerField(default=0)),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attempt_states', to='main.quiz')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quiz_attempt_states', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='quizattemptstate',
+            constraint=models.UniqueConstraint(fields=('quiz', 'user'), name='unique_quiz_attempt_state'),
+        ),
+        migrations.RunPython(backfill_attempt_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:27
+
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def backfill_best_scores(apps, schema_editor):
+    QuizAttempt = apps.get_model("main", "QuizAttempt")
+    QuizAttemptState = apps.get_model("main", "QuizAttemptState")
+    attempts = QuizAttempt.objects.filter(
+        quiz_id=OuterRef("quiz_id"), taken_by_id=OuterRef("user_id")
+    )
+    QuizAttemptState.objects.update(
+        best_score=Subquery(
+            attempts.values("taken_by_id")
+            .annotate(best=Max("score"))
+            .values("best")[:1]
+        )
+    )
+    QuizAttemptState.objects.update(
+        best_scored_at=Subquery(
+            attempts.filter(score=OuterRef("best_score"))
+            .order_by("taken_at")
+            .values("taken_at")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0057_quizstats_questionstats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quizattemptstate',
+            name='best_score',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quizattemptstate',
+            name='best_scored_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='quizattemptstate',
+            index=models.Index(fields=['quiz', '-best_score', 'best_scored_at'], name='quiz_leaderboard_idx'),
+        ),
+        migrations.RunPython(backfill_best_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0058_quizattemptstate_best_score"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="quizattempt",
+            name="packed_answers",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="quizattempt",
+            name="quiz_version",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+    ]
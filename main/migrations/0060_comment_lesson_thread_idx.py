@@ -0,0 +1,20 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0059_quizattempt_packed_answers"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["lesson", "reply_to", "commented_at"],
+                name="comment_lesson_thread_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:37
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0060_comment_lesson_thread_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CommentFanout",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "dispatched_at",
+                    models.DateTimeField(blank=True, default=None, null=True),
+                ),
+                ("attempts", models.PositiveIntegerField(default=0)),
+                ("last_error", models.TextField(blank=True, default="")),
+                (
+                    "comment",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="fanouts",
+                        to="main.comment",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        condition=models.Q(("dispatched_at", None)),
+                        fields=["created_at"],
+                        name="comment_fanout_pending_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0062_pendingmediadeletion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="commentimage",
+            name="display",
+            field=models.ImageField(
+                blank=True, null=True, upload_to="comment_images/display/"
+            ),
+        ),
+        migrations.AddField(
+            model_name="commentimage",
+            name="height",
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="commentimage",
+            name="thumbnail",
+            field=models.ImageField(
+                blank=True, null=True, upload_to="comment_images/thumbnails/"
+            ),
+        ),
+        migrations.AddField(
+            model_name="commentimage",
+            name="width",
+            field=models.PositiveIntegerField(blank=True, default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:48
+
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef, Q
+
+
+def backfill_answered(apps, schema_editor):
+    Comment = apps.get_model("main", "Comment")
+    AchieveUser = apps.get_model("main", "AchieveUser")
+    Group = apps.get_model("auth", "Group")
+
+    def commentor_is_editor():
+        instructor_membership = AchieveUser.groups.through.objects.filter(
+            achieveuser_id=OuterRef("commentor_id"),
+            group__in=Group.objects.filter(name="Instructors"),
+        )
+        return Q(commentor__is_staff=True) | Q(Exists(instructor_membership))
+
+    editor_replies = Comment.objects.filter(reply_to=OuterRef("pk")).filter(
+        commentor_is_editor()
+    )
+    Comment.objects.filter(reply_to=None).filter(
+        commentor_is_editor() | Q(Exists(editor_replies))
+    ).update(answered=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0064_searchdocument"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="comment",
+            name="answered",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                condition=models.Q(("answered", False), ("reply_to", None)),
+                fields=["commented_at", "id"],
+                name="comment_unanswered_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_answered, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.7 on 2026-10-18 17:51
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0065_comment_answered"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LessonReadMarker",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "last_read_at",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="comment",
+            index=models.Index(
+                fields=["lesson", "commented_at"], name="comment_lesson_time_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="lessonreadmarker",
+            name="lesson",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="read_markers",
+                to="main.module",
+            ),
+        ),
+        migrations.AddField(
+            model_name="lessonreadmarker",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="lesson_read_markers",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="lessonreadmarker",
+            constraint=models.UniqueConstraint(
+                fields=("lesson", "user"), name="unique_lesson_read_marker"
+            ),
+        ),
+    ]
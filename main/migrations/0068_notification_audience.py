@@ -0,0 +1,63 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def backfill_audience(apps, schema_editor):
+    # Lesson notifications used to be addressed to a channel group only, the
+    # group they were pushed to follows from their message
+    Notification = apps.get_model("main", "Notification")
+    Module = apps.get_model("main", "Module")
+    lesson_notifications = Notification.objects.filter(
+        reciever=None, lesson__isnull=False
+    )
+    lesson_notifications.filter(message__contains="added a new broadcast").update(
+        audience="students"
+    )
+    lesson_notifications.filter(audience=None).update(audience="editors")
+    lesson_notifications.update(
+        course_id=Subquery(
+            Module.objects.filter(id=OuterRef("lesson_id")).values("course_id")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0067_notification_feed_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="audience",
+            field=models.CharField(
+                blank=True,
+                choices=[("editors", "Editors"), ("students", "Enrolled students")],
+                default=None,
+                max_length=16,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="course",
+            field=models.ForeignKey(
+                default=None,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="course_notifications",
+                to="main.course",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("audience__isnull", False)),
+                fields=["audience", "created_at", "id"],
+                name="notification_audience_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_audience, migrations.RunPython.noop),
+    ]
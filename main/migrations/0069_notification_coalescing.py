@@ -0,0 +1,61 @@
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def backfill_kind(apps, schema_editor):
+    Notification = apps.get_model("main", "Notification")
+    Notification.objects.filter(enrollment__isnull=False).update(kind="enrollment")
+    Notification.objects.filter(
+        Q(audience="students") | Q(message__startswith="A new broadcast")
+    ).update(kind="broadcast")
+    Notification.objects.filter(message="A student left a comment").update(
+        kind="student_comment"
+    )
+    Notification.objects.filter(
+        kind=None, reciever__isnull=False, comment__isnull=False
+    ).update(kind="reply")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0068_notification_audience"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="kind",
+            field=models.CharField(
+                blank=True,
+                choices=[
+                    ("enrollment", "Enrollment"),
+                    ("reply", "Reply"),
+                    ("student_comment", "Student comment"),
+                    ("broadcast", "Broadcast"),
+                ],
+                default=None,
+                max_length=32,
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name="notification",
+            name="digest_pending",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(("digest_pending", True)),
+                fields=["id"],
+                name="notification_digest_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_kind, migrations.RunPython.noop),
+    ]
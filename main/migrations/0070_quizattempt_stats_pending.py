@@ -0,0 +1,49 @@
+from django.db import migrations, models
+from django.db.models import Exists, OuterRef
+
+
+def mark_pending_attempts(apps, schema_editor):
+    # Attempts above their quiz's old last_attempt_id were not aggregated yet
+    QuizAttempt = apps.get_model("main", "QuizAttempt")
+    QuizStats = apps.get_model("main", "QuizStats")
+    QuizAttempt.objects.exclude(
+        Exists(
+            QuizStats.objects.filter(
+                quiz_id=OuterRef("quiz_id"), last_attempt_id__gte=OuterRef("id")
+            )
+        )
+    ).update(stats_pending=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("main", "0069_notification_coalescing"),
+    ]
+
+    operations = [
+        # Added as counted, the few attempts that are not are marked below
+        migrations.AddField(
+            model_name="quizattempt",
+            name="stats_pending",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(mark_pending_attempts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="quizattempt",
+            name="stats_pending",
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddIndex(
+            model_name="quizattempt",
+            index=models.Index(
+                condition=models.Q(("stats_pending", True)),
+                fields=["quiz", "id"],
+                name="quiz_attempt_stats_idx",
+            ),
+        ),
+        migrations.RemoveField(
+            model_name="quizstats",
+            name="last_attempt_id",
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import connection, models, transaction
 from django.utils import timezone
 from django.utils.text import slugify
 from django.contrib.auth.models import AbstractUser, BaseUserManager
@@ -147,6 +149,22 @@ class Quiz(models.Model):
     total_mark = models.IntegerField()
     time_limit = models.PositiveIntegerField(null=True, blank=True)
     attempts_allowed = models.PositiveIntegerField(null=True, blank=True)
+    # Bumped whenever the quiz or its questions change, cached answer keys are keyed on it
+    version = models.PositiveIntegerField(default=1)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+        # Incremented in the database, the in-memory version may be stale
+        self.version = models.F("version") + 1
+        if kwargs.get("update_fields") is not None:
+            kwargs["update_fields"] = {*kwargs["update_fields"], "version"}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=["version"])
+
+    @classmethod
+    def bump_version(cls, quiz_id):
+        cls.objects.filter(id=quiz_id).update(version=models.F("version") + 1)
 
     def __str__(self):
         return self.quiz_title
@@ -164,6 +182,16 @@ class Question(models.Model):
     correct_answer = models.TextField()
     choices = models.JSONField(null=True, blank=True)  # Only relevant for MCQ
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Quiz.bump_version(self.quiz_id)
+
+    def delete(self, *args, **kwargs):
+        quiz_id = self.quiz_id
+        result = super().delete(*args, **kwargs)
+        Quiz.bump_version(quiz_id)
+        return result
+
 
 class QuizAttempt(models.Model):
     quiz = models.ForeignKey(
@@ -175,6 +203,50 @@ class QuizAttempt(models.Model):
     taken_at = models.DateTimeField(default=timezone.now)
     total_attempts = models.IntegerField(default=0)
     score = models.PositiveIntegerField(default=0)
+    # Version of the quiz the attempt was graded against
+    quiz_version = models.PositiveIntegerField(null=True, blank=True)
+    # Compact storage mode (QUIZ_COMPACT_ANSWERS): [[question_id, answer_text, is_correct], ...]
+    # kept on the attempt instead of one Answer row per question
+    packed_answers = models.JSONField(null=True, blank=True)
+    # Not folded into the quiz analytics yet (see main/analytics.py)
+    stats_pending = models.BooleanField(default=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["quiz", "id"],
+                condition=models.Q(stats_pending=True),
+                name="quiz_attempt_stats_idx",
+            )
+        ]
+
+
+# One row per (quiz, user), locked and incremented on every submission so attempt
+# numbers are never duplicated and attempts_allowed is enforced without counting
+class QuizAttemptState(models.Model):
+    quiz = models.ForeignKey(
+        Quiz, on_delete=models.CASCADE, related_name="attempt_states"
+    )
+    user = models.ForeignKey(
+        AchieveUser, on_delete=models.CASCADE, related_name="quiz_attempt_states"
+    )
+    attempts_taken = models.PositiveIntegerField(default=0)
+    # Best score so far, kept up to date by the grading UPDATE for the leaderboard
+    best_score = models.PositiveIntegerField(default=0)
+    best_scored_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["quiz", "user"], name="unique_quiz_attempt_state"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["quiz", "-best_score", "best_scored_at"],
+                name="quiz_leaderboard_idx",
+            )
+        ]
 
 
 class Answer(models.Model):
@@ -191,6 +263,28 @@ class Answer(models.Model):
     is_correct = models.BooleanField(null=True)
 
 
+# Quiz analytics, aggregated incrementally from new attempts (see main/analytics.py)
+
+
+class QuizStats(models.Model):
+    quiz = models.OneToOneField(Quiz, on_delete=models.CASCADE, related_name="stats")
+    attempt_count = models.PositiveIntegerField(default=0)
+    score_histogram = models.JSONField(default=dict)  # {score: attempts}
+    updated_at = models.DateTimeField(default=timezone.now)
+
+
+class QuestionStats(models.Model):
+    question = models.OneToOneField(
+        Question, on_delete=models.CASCADE, related_name="stats"
+    )
+    quiz = models.ForeignKey(
+        Quiz, on_delete=models.CASCADE, related_name="question_stats"
+    )
+    attempt_count = models.PositiveIntegerField(default=0)
+    correct_count = models.PositiveIntegerField(default=0)
+    choice_counts = models.JSONField(default=dict)  # {answer_text: answers}
+
+
 # External Links
 
 
@@ -217,15 +311,75 @@ class Comment(models.Model):
     reply_to = models.ForeignKey(
         "self", on_delete=models.CASCADE, null=True, blank=True, related_name="replies"
     )
+    # Set on a thread once an editor replied to it, editors' own threads
+    # (broadcasts) start answered. Kept current by main/comments.py.
+    answered = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a lesson's threads and of a thread's replies
+            models.Index(
+                fields=["lesson", "reply_to", "commented_at"],
+                name="comment_lesson_thread_idx",
+            ),
+            # Unread comments of a lesson since a LessonReadMarker
+            models.Index(
+                fields=["lesson", "commented_at"], name="comment_lesson_time_idx"
+            ),
+            # Instructors' inbox of unanswered questions
+            models.Index(
+                fields=["commented_at", "id"],
+                name="comment_unanswered_idx",
+                condition=models.Q(answered=False, reply_to=None),
+            ),
+        ]
+
+    def subtree_ids(self):
+        """Ids of this comment and of all its replies at any depth, in one query."""
+        table = connection.ops.quote_name(self._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH RECURSIVE subtree(id) AS (
+                    SELECT id FROM {table} WHERE id = %s
+                    UNION ALL
+                    SELECT reply.id FROM {table} reply
+                    INNER JOIN subtree ON reply.reply_to_id = subtree.id
+                )
+                SELECT id FROM subtree
+                """,
+                [self.id],
+            )
+            return [row[0] for row in cursor.fetchall()]
 
     def delete(self, *args, **kwargs):
-        if self.images:
-            for image in self.images.all():
-                image.delete()
-        if self.replies:
-            for reply in self.replies.all():
-                reply.delete()
-        super().delete(*args, **kwargs)
+        # The whole thread is deleted in bulk, its image files are queued for
+        # the collect_deleted_media command instead of being removed here
+        ids = self.subtree_ids()
+        with transaction.atomic():
+            PendingMediaDeletion.queue(
+                CommentImage.objects.filter(comment_id__in=ids),
+                *CommentImage.FILE_FIELDS,
+            )
+            return Comment.objects.filter(id__in=ids).delete()
+
+
+# When a user last read a lesson's discussion, for the unread badges of a course
+class LessonReadMarker(models.Model):
+    user = models.ForeignKey(
+        AchieveUser, on_delete=models.CASCADE, related_name="lesson_read_markers"
+    )
+    lesson = models.ForeignKey(
+        Module, on_delete=models.CASCADE, related_name="read_markers"
+    )
+    last_read_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["lesson", "user"], name="unique_lesson_read_marker"
+            )
+        ]
 
 
 class CommentImage(models.Model):
@@ -234,24 +388,85 @@ class CommentImage(models.Model):
         Comment, on_delete=models.CASCADE, related_name="images"
     )
     image = models.ImageField(upload_to="comment_images/", blank=True, null=True)
+    # Resized copies made by main/media.py after the upload, which also replaces
+    # the original with a copy stripped of its metadata
+    thumbnail = models.ImageField(
+        upload_to="comment_images/thumbnails/", blank=True, null=True
+    )
+    display = models.ImageField(
+        upload_to="comment_images/display/", blank=True, null=True
+    )
+    width = models.PositiveIntegerField(null=True, blank=True, default=None)
+    height = models.PositiveIntegerField(null=True, blank=True, default=None)
 
-    def save(self, *args, **kwargs):
-        if self.comment.images.count() > self.MAX_IMAGES:
+    FILE_FIELDS = ["image", "thumbnail", "display"]
+
+    @classmethod
+    def add_to_comment(cls, comment, files, existing=None):
+        """Attach uploaded files to a comment with one insert.
+
+        MAX_IMAGES is checked once for the whole batch, `existing` is the number
+        of images the comment already has (counted here when not given).
+        """
+        if existing is None:
+            existing = comment.images.count()
+        if existing + len(files) > cls.MAX_IMAGES:
             raise ValidationError(
-                f"Cannot add more than {self.MAX_IMAGES} images to a comment."
+                f"Cannot add more than {cls.MAX_IMAGES} images to a comment."
             )
-        else:
-            super().save(*args, **kwargs)
+        return cls.objects.bulk_create(
+            [cls(comment=comment, image=file) for file in files]
+        )
 
     def delete(self, *args, **kwargs):
-        if self.image:
-            if os.path.isfile(self.image.path):
-                os.remove(self.image.path)
-        super().delete(*args, **kwargs)
+        with transaction.atomic():
+            PendingMediaDeletion.objects.bulk_create(
+                [
+                    PendingMediaDeletion(path=file.name)
+                    for file in (self.image, self.thumbnail, self.display)
+                    if file
+                ]
+            )
+            return super().delete(*args, **kwargs)
+
+
+# Files of deleted rows, removed from storage in batches by main/media.py
+class PendingMediaDeletion(models.Model):
+    path = models.CharField(max_length=255)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    @classmethod
+    def queue(cls, queryset, *fields):
+        """Queue the files stored in the given file fields of every row of queryset."""
+        cls.objects.bulk_create(
+            [
+                cls(path=path)
+                for paths in queryset.values_list(*fields)
+                for path in paths
+                if path
+            ]
+        )
 
 
 # Norification Pannel
 class Notification(models.Model):
+    # Notifications without a reciever are addressed to an audience and read
+    # by all of its members, see main/notifications.py
+    EDITORS = "editors"
+    STUDENTS = "students"
+    AUDIENCE_CHOICES = [(EDITORS, "Editors"), (STUDENTS, "Enrolled students")]
+
+    ENROLLMENT = "enrollment"
+    REPLY = "reply"
+    STUDENT_COMMENT = "student_comment"
+    BROADCAST = "broadcast"
+    KIND_CHOICES = [
+        (ENROLLMENT, "Enrollment"),
+        (REPLY, "Reply"),
+        (STUDENT_COMMENT, "Student comment"),
+        (BROADCAST, "Broadcast"),
+    ]
+
     reciever = models.ForeignKey(
         AchieveUser,
         on_delete=models.CASCADE,
@@ -282,3 +497,104 @@ class Notification(models.Model):
         related_name="lesson_notifications",
     )
     created_at=models.DateTimeField(default=timezone.now, blank=True, null=True)
+    audience = models.CharField(
+        max_length=16, choices=AUDIENCE_CHOICES, null=True, blank=True, default=None
+    )
+    # Students only read the notifications of the courses they are enrolled in
+    course = models.ForeignKey(
+        Course,
+        on_delete=models.CASCADE,
+        default=None,
+        null=True,
+        related_name="course_notifications",
+    )
+    kind = models.CharField(
+        max_length=32, choices=KIND_CHOICES, null=True, blank=True, default=None
+    )
+    # Number of events folded into this notification, see main/notifications.py
+    count = models.PositiveIntegerField(default=1)
+    # Held back for the next digest instead of being pushed right away
+    digest_pending = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of a user's feed and its unread count
+            models.Index(
+                fields=["reciever", "created_at", "id"],
+                name="notification_feed_idx",
+            ),
+            # The same for the audience streams
+            models.Index(
+                fields=["audience", "created_at", "id"],
+                name="notification_audience_idx",
+                condition=models.Q(audience__isnull=False),
+            ),
+            models.Index(
+                fields=["id"],
+                name="notification_digest_idx",
+                condition=models.Q(digest_pending=True),
+            ),
+        ]
+
+
+# Transactional outbox for the side effects of a new comment. The row is written
+# in the same transaction as the comment and main/fanout.py turns it into
+# notifications and WebSocket events afterwards.
+class CommentFanout(models.Model):
+    comment = models.ForeignKey(
+        Comment, on_delete=models.CASCADE, related_name="fanouts"
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    dispatched_at = models.DateTimeField(null=True, blank=True, default=None)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["created_at"],
+                name="comment_fanout_pending_idx",
+                condition=models.Q(dispatched_at=None),
+            )
+        ]
+
+
+# One row per searchable course, lesson, flashcard or comment, see main/search.py.
+# The source foreign keys make the document go away with its source row.
+class SearchDocument(models.Model):
+    KIND_CHOICES = [
+        ("course", "Course"),
+        ("lesson", "Lesson"),
+        ("flashcard", "Flashcard"),
+        ("comment", "Comment"),
+    ]
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    course = models.ForeignKey(
+        Course, on_delete=models.CASCADE, related_name="search_documents"
+    )
+    lesson = models.ForeignKey(
+        Module, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    flashcard = models.ForeignKey(
+        Flashcard, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    comment = models.ForeignKey(
+        Comment, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    # Students read a document when it is public or when they own it (comments)
+    owner = models.ForeignKey(
+        AchieveUser, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    is_public = models.BooleanField(default=True)
+    title = models.TextField(blank=True, default="")
+    body = models.TextField(blank=True, default="")
+    search_vector = SearchVectorField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "object_id"], name="unique_search_document"
+            )
+        ]
+        indexes = [GinIndex(fields=["search_vector"], name="search_document_gin")]
@@ -0,0 +1,340 @@
+import atexit
+import heapq
+import json
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import timedelta
+from itertools import islice
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from main import roles
+from main.models import AchieveUser, CourseEnrollment, Notification
+from main.serializers import NotificationSerializer
+from main.utils import encode_cursor, paginate_keyset, run_in_background
+
+# The notification bell: a user's feed, newest first, and how many of its
+# notifications arrived since the user last opened it.
+#
+# Notifications addressed to a whole audience (every editor, or the students
+# of a course) are stored once, without a reciever. A feed is read from a few
+# streams, the user's personal notifications plus the audience streams the
+# user belongs to, each served by its own (.., created_at, id) index, and
+# merged at read time. The cost of a page does not grow with the user's
+# history nor with the size of the audiences.
+#
+# Replies and student comments are coalesced when they are saved: within
+# NOTIFICATION_COALESCE_WINDOW seconds, another one for the same receiver and
+# lesson is folded into the existing row ("7 new comments in lesson X"),
+# which moves back to the top of the feed. With NOTIFICATION_DIGEST they are
+# not pushed as they come either, send_notification_digests pushes what
+# changed since its last run, one event per channel group.
+#
+# Old notifications are moved out of the table by archive_notifications into
+# gzipped JSON lines files.
+#
+# Opening the bell marks everything as seen. The frontend does that on every
+# open, so a process writes a user's last_seen_notifications at most once per
+# LAST_SEEN_WRITE_INTERVAL seconds: later calls are buffered in memory and
+# written together, in one UPDATE, at the end of the interval. The buffered
+# value is already used for the unread counts the process serves.
+
+COALESCED_KINDS = (Notification.REPLY, Notification.STUDENT_COMMENT)
+
+
+def get_notification_streams(user):
+    """Return one queryset per stream of notifications the user reads."""
+    streams = [Notification.objects.filter(reciever=user)]
+    if roles.is_editor(user):
+        streams.append(Notification.objects.filter(audience=Notification.EDITORS))
+    else:
+        streams.append(
+            Notification.objects.filter(
+                audience=Notification.STUDENTS,
+                course__in=CourseEnrollment.objects.filter(user=user).values(
+                    "course_id"
+                ),
+            )
+        )
+    return streams
+
+
+def get_notification_page(user, cursor, limit):
+    """Return (notifications, next_cursor) for one page of the user's feed."""
+    pages = []
+    has_more = False
+    for stream in get_notification_streams(user):
+        stream = stream.only(
+            "id", "reciever_id", "audience", "kind", "count", "message", "created_at"
+        )
+        rows, next_cursor = paginate_keyset(stream, "created_at", cursor, limit)
+        pages.append(rows)
+        has_more = has_more or next_cursor is not None
+    # Every stream page is newest first, so is their merge
+    merged = list(
+        islice(
+            heapq.merge(
+                *pages,
+                key=lambda notification: (notification.created_at, notification.id),
+                reverse=True,
+            ),
+            limit + 1,
+        )
+    )
+    notifications = merged[:limit]
+    next_cursor = None
+    if has_more or len(merged) > limit:
+        last = notifications[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return notifications, next_cursor
+
+
+def get_unread_count(user):
+    last_seen = get_last_seen(user)
+    count = 0
+    for stream in get_notification_streams(user):
+        if last_seen is not None:
+            stream = stream.filter(created_at__gt=last_seen)
+        count += stream.count()
+    return count
+
+
+_last_seen_lock = threading.Lock()
+_last_seen_buffer = {}  # {user_id: seen_at} waiting for the next flush
+# {user_id: time.monotonic() of the last write}, oldest write first
+_last_seen_written = OrderedDict()
+_last_seen_timer = None
+
+
+def _set_last_seen_written(user_id, now, interval):
+    """Record a write, forgetting the users whose last write is stale.
+
+    Must hold _last_seen_lock. Entries are kept in write order, so the stale
+    ones are at the front and the map only holds the users written within the
+    last interval.
+    """
+    while _last_seen_written:
+        oldest, written = next(iter(_last_seen_written.items()))
+        if now - written < interval:
+            break
+        del _last_seen_written[oldest]
+    _last_seen_written[user_id] = now
+    _last_seen_written.move_to_end(user_id)
+
+
+def get_last_seen(user):
+    buffered = _last_seen_buffer.get(user.pk)
+    if buffered is not None and (
+        user.last_seen_notifications is None or buffered > user.last_seen_notifications
+    ):
+        return buffered
+    return user.last_seen_notifications
+
+
+def mark_notifications_seen(user, seen_at):
+    """Set the user's last_seen_notifications, coalescing rapid calls."""
+    global _last_seen_timer
+    interval = settings.LAST_SEEN_WRITE_INTERVAL
+    with _last_seen_lock:
+        now = time.monotonic()
+        written = _last_seen_written.get(user.pk)
+        if written is not None and now - written < interval:
+            _last_seen_buffer[user.pk] = seen_at
+            if _last_seen_timer is None:
+                _last_seen_timer = threading.Timer(
+                    interval, run_in_background, (flush_last_seen,)
+                )
+                _last_seen_timer.daemon = True
+                _last_seen_timer.start()
+            return
+        _set_last_seen_written(user.pk, now, interval)
+        _last_seen_buffer.pop(user.pk, None)
+    AchieveUser.objects.filter(pk=user.pk).update(last_seen_notifications=seen_at)
+
+
+def flush_last_seen():
+    """Write the buffered last_seen_notifications. Returns the number of users."""
+    global _last_seen_timer
+    interval = settings.LAST_SEEN_WRITE_INTERVAL
+    with _last_seen_lock:
+        now = time.monotonic()
+        buffered = dict(_last_seen_buffer)
+        _last_seen_buffer.clear()
+        _last_seen_timer = None
+        for user_id in buffered:
+            _set_last_seen_written(user_id, now, interval)
+    AchieveUser.objects.bulk_update(
+        [
+            AchieveUser(pk=user_id, last_seen_notifications=seen_at)
+            for user_id, seen_at in buffered.items()
+        ],
+        ["last_seen_notifications"],
+    )
+    return len(buffered)
+
+
+# Do not lose the last interval's calls on a clean shutdown
+atexit.register(flush_last_seen)
+
+
+def coalesce_key(notification):
+    return (
+        notification.kind,
+        notification.reciever_id,
+        notification.audience,
+        notification.lesson_id,
+    )
+
+
+def fold(notification, other):
+    """Fold other, a newer notification of the same key, into notification.
+
+    notification.lesson must be loaded.
+    """
+    notification.count += other.count
+    notification.comment_id = other.comment_id
+    notification.created_at = other.created_at
+    title = notification.lesson.module_title
+    if notification.kind == Notification.REPLY:
+        notification.message = (
+            f"{notification.count} new replies to your comments in lesson {title}"
+        )
+    else:
+        notification.message = f"{notification.count} new comments in lesson {title}"
+
+
+def save_notifications(notifications):
+    """Save (notification, group) pairs, coalescing them with recent rows.
+
+    Must run in a transaction. Returns the (notification, group) pairs of the
+    rows that were created or updated, coalesced rows hold their new count and
+    message.
+    """
+    window = settings.NOTIFICATION_COALESCE_WINDOW
+    created = []
+    coalesced = {}
+    for notification, group in notifications:
+        if not window or notification.kind not in COALESCED_KINDS:
+            created.append((notification, group))
+            continue
+        key = coalesce_key(notification)
+        if key in coalesced:
+            fold(coalesced[key][0], notification)
+        else:
+            coalesced[key] = (notification, group)
+
+    updated = []
+    if coalesced:
+        # Latest row of every key within the window, locked so concurrent
+        # dispatchers do not lose counts
+        recent = (
+            Notification.objects.select_for_update()
+            .filter(
+                kind__in=COALESCED_KINDS,
+                lesson_id__in={key[3] for key in coalesced},
+                created_at__gte=timezone.now() - timedelta(seconds=window),
+            )
+            .order_by("created_at", "id")
+        )
+        latest = {coalesce_key(row): row for row in recent}
+        for key, (notification, group) in coalesced.items():
+            row = latest.get(key)
+            if row is None:
+                created.append((notification, group))
+                continue
+            row.lesson = notification.lesson
+            fold(row, notification)
+            updated.append((row, group))
+
+    if settings.NOTIFICATION_DIGEST:
+        for notification, _ in created + updated:
+            notification.digest_pending = notification.kind in COALESCED_KINDS
+    Notification.objects.bulk_create([notification for notification, _ in created])
+    Notification.objects.bulk_update(
+        [row for row, _ in updated],
+        ["count", "message", "comment", "created_at", "digest_pending"],
+    )
+    return created + updated
+
+
+def notification_group(notification):
+    if notification.reciever_id is not None:
+        return f"user_{notification.reciever_id}"
+    if notification.audience == Notification.EDITORS:
+        return "Editors"
+    return "Students"
+
+
+def send_notification_digests(batch_size=500):
+    """Push the notifications held back for the digest, one event per group.
+
+    Returns the number of notifications sent.
+    """
+    sent = 0
+    channel_layer = get_channel_layer()
+    while True:
+        with transaction.atomic():
+            notifications = list(
+                Notification.objects.select_for_update(skip_locked=True)
+                .filter(digest_pending=True)
+                .order_by("id")[:batch_size]
+            )
+            if not notifications:
+                return sent
+            digests = defaultdict(list)
+            for notification in notifications:
+                digests[notification_group(notification)].append(
+                    NotificationSerializer(notification).data
+                )
+                notification.digest_pending = False
+            Notification.objects.bulk_update(notifications, ["digest_pending"])
+        for group, messages in digests.items():
+            async_to_sync(channel_layer.group_send)(
+                group, {"type": "notification_digest", "message": messages}
+            )
+        sent += len(notifications)
+
+
+def archive_notifications(out, cutoff, seen=False, batch_size=1000, pause=0):
+    """Move notifications created before cutoff to out, a binary file.
+
+    With seen, personal notifications their receiver has already seen go too.
+    Rows are written as JSON lines and deleted in batches of batch_size, each
+    in its own short transaction, sleeping pause seconds between batches.
+    Returns (rows, bytes) archived, bytes being the size of the JSON written.
+    """
+    archivable = Q(created_at__lt=cutoff)
+    if seen:
+        archivable |= Q(
+            reciever__isnull=False,
+            created_at__lte=F("reciever__last_seen_notifications"),
+        )
+    notifications = Notification.objects.filter(archivable, digest_pending=False)
+    archived = 0
+    archived_bytes = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                notifications.select_for_update(skip_locked=True, of=("self",))
+                .order_by("id")
+                .values_list("id", flat=True)[:batch_size]
+            )
+            if not ids:
+                return archived, archived_bytes
+            rows = Notification.objects.filter(id__in=ids).order_by("id").values()
+            data = "".join(
+                json.dumps(row, cls=DjangoJSONEncoder) + "\n" for row in rows
+            ).encode()
+            # The batch is on disk before its rows are gone
+            out.write(data)
+            out.flush()
+            Notification.objects.filter(id__in=ids).delete()
+        archived += len(ids)
+        archived_bytes += len(data)
+        if pause:
+            time.sleep(pause)
@@ -1,22 +1,16 @@
 from rest_framework.permissions import BasePermission
 from main.models import Comment
+from main.roles import is_editor
 from rest_framework.exceptions import NotFound
 
 
 class IsStaffOrIsInstructor(BasePermission):
     def has_permission(self, request, view):
-        return request.user and (
-            request.user.is_staff
-            or request.user.groups.filter(name="Instructors").exists()
-        )
+        return request.user and is_editor(request.user)
 
 class IsCommentorOrHasPerms(BasePermission):
     def has_object_permission(self, request, view, obj):
         if not isinstance(obj, Comment):
             raise NotFound("Comment not found")
 
-        return (
-            request.user.is_staff
-            or request.user.groups.filter(name="Instructors").exists()
-            or obj.commentor == request.user
-        )
\ No newline at end of file
+        return is_editor(request.user) or obj.commentor_id == request.user.id
\ No newline at end of file
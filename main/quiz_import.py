@@ -0,0 +1,246 @@
+import csv
+import io
+import json
+from django.db import transaction
+from rest_framework import serializers
+from main.models import Quiz, Question
+
+# Bulk quiz import. A question bank is read row by row from the uploaded file,
+# validated in chunks and inserted with bulk_create, all inside one
+# transaction that is rolled back if any row is invalid.
+
+CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 1000
+QUIZ_FIELDS = [
+    "quiz_title",
+    "quiz_description",
+    "total_mark",
+    "time_limit",
+    "attempts_allowed",
+]
+
+
+class QuizImportRowSerializer(serializers.Serializer):
+    # One question, with the fields of the quiz it belongs to
+    quiz_title = serializers.CharField(max_length=100)
+    quiz_description = serializers.CharField(
+        required=False, allow_blank=True, default=""
+    )
+    total_mark = serializers.IntegerField(required=False, allow_null=True, default=None)
+    time_limit = serializers.IntegerField(
+        required=False, allow_null=True, default=None, min_value=0
+    )
+    attempts_allowed = serializers.IntegerField(
+        required=False, allow_null=True, default=None, min_value=0
+    )
+    question_text = serializers.CharField()
+    question_type = serializers.ChoiceField(choices=["MCQ", "TF"])
+    correct_answer = serializers.CharField()
+    choices = serializers.ListField(
+        child=serializers.CharField(), required=False, default=list
+    )
+    question_point = serializers.IntegerField(min_value=0)
+    question_time_limit = serializers.IntegerField(
+        required=False, allow_null=True, default=None, min_value=0
+    )
+
+    def validate(self, data):
+        if (
+            data["question_type"] == "MCQ"
+            and data["correct_answer"] not in data["choices"]
+        ):
+            raise serializers.ValidationError(
+                {"correct_answer": "Must be one of the choices"}
+            )
+        if data["question_type"] == "TF" and data["correct_answer"] not in (
+            "True",
+            "False",
+        ):
+            raise serializers.ValidationError(
+                {"correct_answer": "Must be True or False"}
+            )
+        return data
+
+
+def _empty_to_none(row):
+    # CSV cells are always strings, empty optional cells mean "not set"
+    return {key: value for key, value in row.items() if key and value not in ("", None)}
+
+
+def _parse_choices(row):
+    choices = row.get("choices")
+    if isinstance(choices, str):
+        choices = choices.strip()
+        if choices.startswith("["):
+            row["choices"] = json.loads(choices)
+        else:
+            row["choices"] = [
+                choice.strip() for choice in choices.split("|") if choice.strip()
+            ]
+    return row
+
+
+def _flatten(record):
+    # Accept quizzes in the AddQuizView shape (with nested "questions") as well as flat rows
+    if isinstance(record, dict) and isinstance(record.get("questions"), list):
+        quiz_data = {field: record[field] for field in QUIZ_FIELDS if field in record}
+        for question in record["questions"]:
+            yield {**quiz_data, **question} if isinstance(question, dict) else question
+    else:
+        yield record
+
+
+def _iter_csv(file):
+    text = io.TextIOWrapper(file, encoding="utf-8-sig")
+    for row_number, row in enumerate(csv.DictReader(text), start=1):
+        try:
+            yield row_number, _parse_choices(_empty_to_none(row)), None
+        except json.JSONDecodeError:
+            yield row_number, None, {"choices": "Invalid JSON list"}
+
+
+def _iter_jsonl(file):
+    row_number = 0
+    text = io.TextIOWrapper(file, encoding="utf-8")
+    for line in text:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            row_number += 1
+            yield row_number, None, {"error": "Invalid JSON"}
+            continue
+        for row in _flatten(record):
+            row_number += 1
+            yield row_number, row, None
+
+
+def _iter_json(file):
+    try:
+        records = json.load(file)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        yield 0, None, {"error": "Invalid JSON"}
+        return
+    if isinstance(records, dict):
+        records = records.get("quizzes", [records])
+    if not isinstance(records, list):
+        yield 0, None, {"error": "Expected a list of quizzes or questions"}
+        return
+    row_number = 0
+    for record in records:
+        for row in _flatten(record):
+            row_number += 1
+            yield row_number, row, None
+
+
+def iter_rows(file, file_format):
+    """Yield (row_number, row, parse_error) from an uploaded question bank.
+
+    Errors about the whole file are reported on row 0.
+    """
+    if file_format == "csv":
+        rows = _iter_csv(file)
+    elif file_format == "jsonl":
+        rows = _iter_jsonl(file)
+    else:
+        rows = _iter_json(file)
+    try:
+        yield from rows
+    except UnicodeDecodeError:
+        # Text files are decoded while they are read
+        yield 0, None, {"error": "The file is not valid UTF-8"}
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_quizzes(file, file_format, module, quiz_creator):
+    """Import a question bank into a module.
+
+    Returns a report dict. When any row is invalid nothing is written and the
+    report lists the errors per row.
+    """
+    quizzes = {}
+    marks = {}
+    questions_created = 0
+    errors = []
+    error_count = 0
+
+    with transaction.atomic():
+        for chunk in _chunks(iter_rows(file, file_format), CHUNK_SIZE):
+            valid_rows = []
+            for row_number, row, parse_error in chunk:
+                if parse_error is None:
+                    serializer = QuizImportRowSerializer(data=row)
+                    if serializer.is_valid():
+                        valid_rows.append(serializer.validated_data)
+                        continue
+                    parse_error = serializer.errors
+                error_count += 1
+                if len(errors) < MAX_REPORTED_ERRORS:
+                    errors.append({"row": row_number, "errors": parse_error})
+
+            # Once a row has failed nothing more is written, the rest is only validated
+            if error_count:
+                continue
+
+            new_quizzes = []
+            for row in valid_rows:
+                title = row["quiz_title"]
+                if title not in quizzes:
+                    quiz = Quiz(
+                        module=module,
+                        quiz_creator=quiz_creator,
+                        quiz_title=title,
+                        quiz_description=row["quiz_description"],
+                        total_mark=row["total_mark"] or 0,
+                        time_limit=row["time_limit"],
+                        attempts_allowed=row["attempts_allowed"],
+                    )
+                    quizzes[title] = quiz
+                    marks[title] = 0
+                    new_quizzes.append(quiz)
+            Quiz.objects.bulk_create(new_quizzes)
+
+            question_list = []
+            for row in valid_rows:
+                marks[row["quiz_title"]] += row["question_point"]
+                question_list.append(
+                    Question(
+                        quiz=quizzes[row["quiz_title"]],
+                        question_text=row["question_text"],
+                        question_type=row["question_type"],
+                        correct_answer=row["correct_answer"],
+                        choices=row["choices"],
+                        question_point=row["question_point"],
+                        question_time_limit=row["question_time_limit"],
+                    )
+                )
+            Question.objects.bulk_create(question_list)
+            questions_created += len(question_list)
+
+        if error_count:
+            transaction.set_rollback(True)
+            return {"errors": errors, "error_count": error_count}
+
+        # Quizzes imported without a total mark get the sum of their question points
+        unmarked = []
+        for title, quiz in quizzes.items():
+            if not quiz.total_mark:
+                quiz.total_mark = marks[title]
+                unmarked.append(quiz)
+        Quiz.objects.bulk_update(unmarked, ["total_mark"])
+
+    return {
+        "quizzes_created": len(quizzes),
+        "questions_created": questions_created,
+    }
@@ -0,0 +1,55 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.renderers import JSONRenderer
+from main.models import Quiz
+from main.serializers import QuizSerializer
+
+
+# Pre-rendered quiz payloads for GetQuizByIdView. Everything is cached per quiz
+# version, so an edit (which bumps Quiz.version) is the only thing that causes
+# a rebuild and every request in between gets byte-identical JSON.
+
+
+def get_quiz_definition(quiz_id, version):
+    """Return the full (editor) serialization of a quiz and its questions."""
+    cache_key = f"quiz_definition:{quiz_id}:{version}"
+    definition = cache.get(cache_key)
+    if definition is None:
+        quiz = (
+            Quiz.objects.select_related("quiz_creator")
+            .prefetch_related("questions")
+            .get(id=quiz_id)
+        )
+        quiz_data = QuizSerializer(quiz).data
+        definition = {"quiz": quiz_data, "questions": quiz_data["questions"]}
+        cache.set(cache_key, definition, settings.QUIZ_PAYLOAD_CACHE_TIMEOUT)
+    return definition
+
+
+def strip_answers(questions):
+    return [
+        {field: value for field, value in question.items() if field != "correct_answer"}
+        for question in questions
+    ]
+
+
+def get_quiz_payload(quiz_id, version, include_answers):
+    """Return (body, etag) for a quiz, with correct answers only for editors."""
+    audience = "editor" if include_answers else "student"
+    cache_key = f"quiz_payload:{quiz_id}:{version}:{audience}"
+    payload = cache.get(cache_key)
+    if payload is None:
+        definition = get_quiz_definition(quiz_id, version)
+        questions = definition["questions"]
+        if not include_answers:
+            questions = strip_answers(questions)
+        data = {
+            "quiz": {**definition["quiz"], "questions": questions},
+            "questions": questions,
+        }
+        body = JSONRenderer().render(data)
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        payload = (body, etag)
+        cache.set(cache_key, payload, settings.QUIZ_PAYLOAD_CACHE_TIMEOUT)
+    return payload
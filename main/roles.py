@@ -0,0 +1,38 @@
+# Role resolution. A user's roles are the names of their groups; they are
+# looked up at most once per user object, so once per request, or per
+# WebSocket connection. They are not cached across requests: the default cache
+# is local to each process, so a membership change could not be seen by the
+# other workers until the entry expired.
+
+INSTRUCTORS = "Instructors"
+STUDENTS = "Students"
+
+
+def get_roles(user):
+    """Return the frozenset of group names of a user."""
+    if not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, "_roles", None)
+    if roles is not None:
+        return roles
+    prefetched = getattr(user, "_prefetched_objects_cache", {})
+    if "groups" in prefetched:
+        roles = frozenset(group.name for group in prefetched["groups"])
+    else:
+        roles = frozenset(user.groups.values_list("name", flat=True))
+    user._roles = roles
+    return roles
+
+
+def is_instructor(user):
+    return INSTRUCTORS in get_roles(user)
+
+
+def is_student(user):
+    return STUDENTS in get_roles(user)
+
+
+def is_editor(user):
+    """Staff and instructors can edit content and read every comment."""
+    return user.is_staff or is_instructor(user)
+
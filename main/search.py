@@ -0,0 +1,146 @@
+from django.conf import settings
+from django.contrib.postgres.search import (
+    SearchHeadline,
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db.models import F, Q
+from main.models import CourseEnrollment, SearchDocument
+
+# Full-text search over courses, lessons, flashcards and comments. Every
+# searchable row has one SearchDocument holding its text and a precomputed
+# tsvector behind a GIN index, so a search is a single indexed query however
+# many documents there are.
+#
+# Documents are written when their source is saved (course, lesson and
+# flashcard post_save signals, see main/signals.py) and, for comments, by the
+# fan-out dispatcher in main/fanout.py, which already knows who can read them.
+# They are removed by the database cascade of their source row.
+# rebuild_search_index rewrites all of them.
+
+
+def course_document(course):
+    return SearchDocument(
+        kind="course",
+        object_id=course.id,
+        course_id=course.id,
+        title=course.course_title,
+        body=course.description,
+    )
+
+
+def lesson_document(lesson):
+    return SearchDocument(
+        kind="lesson",
+        object_id=lesson.id,
+        course_id=lesson.course_id,
+        lesson_id=lesson.id,
+        title=lesson.module_title,
+        body=lesson.topic,
+    )
+
+
+def flashcard_document(flashcard):
+    return SearchDocument(
+        kind="flashcard",
+        object_id=flashcard.id,
+        course_id=flashcard.lesson.course_id,
+        lesson_id=flashcard.lesson_id,
+        flashcard_id=flashcard.id,
+        title=flashcard.question,
+        body=flashcard.answer,
+    )
+
+
+def comment_document(comment, commentor_is_editor):
+    """Document of a comment, readable by the same students as the comment.
+
+    comment.reply_to (with its commentor) must be loaded for replies.
+    """
+    owner_id = None
+    is_public = False
+    if comment.reply_to_id is None:
+        # A thread is its author's, threads started by editors are broadcasts
+        owner_id = comment.commentor_id
+        is_public = commentor_is_editor
+    elif comment.reply_to.reply_to_id is None:
+        owner_id = comment.reply_to.commentor_id
+    return SearchDocument(
+        kind="comment",
+        object_id=comment.id,
+        course_id=comment.lesson.course_id,
+        lesson_id=comment.lesson_id,
+        comment_id=comment.id,
+        owner_id=owner_id,
+        is_public=is_public,
+        body=comment.comment,
+    )
+
+
+def index_documents(documents):
+    """Insert or replace documents, with their search vectors, in two queries."""
+    if not documents:
+        return
+    documents = SearchDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=["kind", "object_id"],
+        update_fields=[
+            "course",
+            "lesson",
+            "flashcard",
+            "comment",
+            "owner",
+            "is_public",
+            "title",
+            "body",
+        ],
+    )
+    config = settings.SEARCH_CONFIG
+    SearchDocument.objects.filter(
+        id__in=[document.id for document in documents]
+    ).update(
+        search_vector=SearchVector("title", weight="A", config=config)
+        + SearchVector("body", weight="B", config=config)
+    )
+
+
+def readable_documents(user, is_editor):
+    """Return the documents the user may read.
+
+    Students only read the courses they are enrolled in, and only the
+    comments they could read in the forum. Editors read everything.
+    """
+    documents = SearchDocument.objects.all()
+    if not is_editor:
+        documents = documents.filter(
+            Q(is_public=True) | Q(owner=user),
+            course__in=CourseEnrollment.objects.filter(user=user).values("course_id"),
+        )
+    return documents
+
+
+def search_documents(user, is_editor, text, limit=20, kind=None):
+    """Return the best matching documents the user may read, best first."""
+    config = settings.SEARCH_CONFIG
+    query = SearchQuery(text, search_type="websearch", config=config)
+    documents = readable_documents(user, is_editor).filter(search_vector=query)
+    if kind is not None:
+        documents = documents.filter(kind=kind)
+    return list(
+        documents.annotate(
+            rank=SearchRank(F("search_vector"), query),
+            snippet=SearchHeadline("body", query, config=config, max_words=30),
+        )
+        .order_by("-rank", "-id")
+        .values(
+            "kind",
+            "object_id",
+            "course_id",
+            "lesson_id",
+            "title",
+            "snippet",
+            "rank",
+        )[:limit]
+    )
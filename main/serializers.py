@@ -14,9 +14,14 @@ from .models import (
     Comment,
     CommentImage,
     CourseEnrollment,
-    Notification
+    Notification,
+    QuizStats,
+    QuestionStats,
+    QuizAttemptState,
 )
 from django.shortcuts import get_object_or_404
+from main.grading import submit_attempt
+from main.media import schedule_image_processing
 
 
 class AchieveUserSerializer(serializers.ModelSerializer):
@@ -227,9 +232,32 @@ class QuizSerializer(serializers.ModelSerializer):
             question_instance = Question(quiz=quiz, **question)
             question_list.append(question_instance)
         Question.objects.bulk_create(question_list)
+        # bulk_create skips Question.save, so the version is bumped here
+        Quiz.bump_version(quiz.id)
         return quiz
 
 
+# Lightweight listing, question_count and question_marks are annotated in SQL
+class QuizSummarySerializer(serializers.ModelSerializer):
+    module_id = serializers.IntegerField(read_only=True)
+    question_count = serializers.IntegerField(read_only=True)
+    question_marks = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Quiz
+        fields = [
+            "id",
+            "quiz_title",
+            "quiz_description",
+            "total_mark",
+            "time_limit",
+            "module_id",
+            "attempts_allowed",
+            "question_count",
+            "question_marks",
+        ]
+
+
 class QuizAttemptSerializer(serializers.ModelSerializer):
     taken_by = AchieveUserSerializer(read_only=True)
 
@@ -244,6 +272,46 @@ class QuizAttemptSerializer(serializers.ModelSerializer):
         ]
 
 
+class QuizStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = QuizStats
+        fields = ["quiz_id", "attempt_count", "score_histogram", "updated_at"]
+
+
+class QuestionStatsSerializer(serializers.ModelSerializer):
+    question_text = serializers.CharField(source="question.question_text")
+    question_type = serializers.CharField(source="question.question_type")
+
+    class Meta:
+        model = QuestionStats
+        fields = [
+            "question_id",
+            "question_text",
+            "question_type",
+            "attempt_count",
+            "correct_count",
+            "choice_counts",
+        ]
+
+
+class LeaderboardEntrySerializer(serializers.ModelSerializer):
+    rank = serializers.IntegerField(read_only=True)
+    user_id = serializers.IntegerField(read_only=True)
+    first_name = serializers.CharField(source="user.first_name", read_only=True)
+    last_name = serializers.CharField(source="user.last_name", read_only=True)
+
+    class Meta:
+        model = QuizAttemptState
+        fields = [
+            "rank",
+            "user_id",
+            "first_name",
+            "last_name",
+            "best_score",
+            "best_scored_at",
+        ]
+
+
 class AnswerSerializer(serializers.ModelSerializer):
     question_id = serializers.IntegerField()
 
@@ -269,54 +337,7 @@ class SubmitAnswerSerializer(serializers.Serializer):
             )
         answers = validated_data.get("answers", [])
 
-        taken_by = request.user
-        answers_list = []
-        score = 0
-
-        # We count previous attempts and create a new attempt to link it with the answers table
-        prev_attempt = QuizAttempt.objects.filter(
-            taken_by=taken_by, quiz_id=quiz_id
-        ).count()
-        total_attempt = prev_attempt + 1
-        attempt = QuizAttempt.objects.create(
-            quiz_id=quiz_id,
-            taken_by=taken_by,
-            total_attempts=total_attempt,
-        )
-
-        # Answers Logic
-        for answer in answers:
-            question_id = answer.pop("question_id")
-            answer_text = answer.pop("answer_text")
-            question_data = (
-                Question.objects.filter(id=question_id)
-                .values("correct_answer", "question_point")
-                .first()
-            )
-
-            if not question_data:
-                raise serializers.ValidationError("Invalid question id")
-
-            correct_answer = question_data["correct_answer"]
-            question_point = question_data["question_point"]
-
-            is_correct = answer_text == correct_answer
-            if is_correct:
-                score += question_point
-
-            answers_list.append(
-                Answer(
-                    answer_text=answer_text,
-                    is_correct=is_correct,
-                    question_id=question_id,
-                    attempt=attempt,
-                )
-            )
-
-        Answer.objects.bulk_create(answers_list)
-
-        attempt.score = score
-        attempt.save(update_fields=["score"])
+        attempt = submit_attempt(quiz_id, request.user, answers)
 
         return {
             "id": attempt.id
@@ -328,10 +349,22 @@ class SubmitAnswerSerializer(serializers.Serializer):
 
 class CommentImageSerializer(serializers.ModelSerializer):
     image = serializers.ImageField(required=False, allow_null=True)
+    # Null until main/media.py has rendered them
+    thumbnail = serializers.ImageField(read_only=True)
+    display = serializers.ImageField(read_only=True)
 
     class Meta:
         model = CommentImage
-        fields = ["id", "image"]
+        fields = ["id", "image", "thumbnail", "display", "width", "height"]
+        read_only_fields = ["width", "height"]
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # The upload still has its EXIF/GPS metadata until main/media.py has
+        # replaced it, and keeps it when it could not be decoded
+        if not instance.width:
+            data["image"] = None
+        return data
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -339,7 +372,7 @@ class CommentSerializer(serializers.ModelSerializer):
     images = CommentImageSerializer(many=True, required=False)
     lesson_id = serializers.IntegerField()
     reply_to_id = serializers.IntegerField(required=False)
-    replies = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    replies = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
@@ -354,10 +387,23 @@ class CommentSerializer(serializers.ModelSerializer):
             "replies",
         ]
 
+    def get_replies(self, comment):
+        # Reply ids are precomputed when a whole lesson is loaded (main/comments.py)
+        reply_ids = getattr(comment, "reply_ids", None)
+        if reply_ids is None:
+            reply_ids = list(comment.replies.values_list("id", flat=True))
+        return reply_ids
+
     # Need to override the internal value func for handeling multiple images
     def to_internal_value(self, data):
         images_data = data.getlist("images")
         internal_value = super().to_internal_value(data)
+        if len(images_data) > CommentImage.MAX_IMAGES:
+            raise serializers.ValidationError(
+                {
+                    "images": f"Cannot add more than {CommentImage.MAX_IMAGES} images to a comment."
+                }
+            )
         internal_value["images"] = images_data
         return internal_value
 
@@ -373,17 +419,47 @@ class CommentSerializer(serializers.ModelSerializer):
             reply_to_id=reply_to_id,
             **validated_data
         )
-        image_list = []
-        for image in images:
-            image = CommentImage(comment=comment, image=image)
-            image_list.append(image)
-        CommentImage.objects.bulk_create(image_list)
+        # A new comment has no images yet, so the limit needs no query
+        image_list = CommentImage.add_to_comment(comment, images, existing=0)
+        schedule_image_processing([image.id for image in image_list])
         return comment
 
+# Top-level comment of a paginated lesson, replies are fetched per thread
+class CommentThreadSerializer(CommentSerializer):
+    reply_count = serializers.IntegerField(read_only=True)
+
+    class Meta(CommentSerializer.Meta):
+        fields = [
+            "id",
+            "comment",
+            "commentor",
+            "images",
+            "lesson_id",
+            "commented_at",
+            "reply_to_id",
+            "reply_count",
+        ]
+
+# Thread waiting for an answer, listed across lessons in the instructors' inbox
+class UnansweredCommentSerializer(CommentSerializer):
+    lesson_title = serializers.CharField(source="lesson.module_title", read_only=True)
+    course_id = serializers.IntegerField(source="lesson.course_id", read_only=True)
+
+    class Meta(CommentSerializer.Meta):
+        fields = [
+            "id",
+            "comment",
+            "commentor",
+            "images",
+            "lesson_id",
+            "lesson_title",
+            "course_id",
+            "commented_at",
+        ]
+
 #NOTIFICATIONS
 
 class NotificationSerializer(serializers.ModelSerializer):
-    reciever=AchieveUserSerializer(read_only=True)
     class Meta:
         model=Notification
-        fields=["id","reciever", "message", "created_at"]
\ No newline at end of file
+        fields=["id","reciever", "audience", "kind", "count", "message", "created_at"]
\ No newline at end of file
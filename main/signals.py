@@ -0,0 +1,27 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from main.models import Course, Flashcard, Module
+from main.search import (
+    course_document,
+    flashcard_document,
+    index_documents,
+    lesson_document,
+)
+
+# Receivers are connected in MainConfig.ready
+
+
+@receiver(post_save, sender=Course)
+def index_course(sender, instance, **kwargs):
+    index_documents([course_document(instance)])
+
+
+@receiver(post_save, sender=Module)
+def index_lesson(sender, instance, **kwargs):
+    index_documents([lesson_document(instance)])
+
+
+@receiver(post_save, sender=Flashcard)
+def index_flashcard(sender, instance, **kwargs):
+    index_documents([flashcard_document(instance)])
+
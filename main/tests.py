@@ -1,3 +1,1513 @@
-from django.test import TestCase
+import io
+import json
+import tempfile
+import threading
+import tracemalloc
+from datetime import timedelta
+from unittest import mock, skipUnless
+from asgiref.sync import sync_to_async
+from PIL import Image
+from django.contrib.auth.models import Group
+from django.contrib.postgres.search import SearchQuery
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, connections, transaction
+from django.test import (
+    AsyncClient,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+from main import media, notifications, roles, utils
+from main.serializers import CommentImageSerializer
+from main.search import comment_document, index_documents, readable_documents
+from rest_framework import serializers
+from main.fanout import dispatch_pending_fanouts
+from main.grading import (
+    get_answer_key,
+    get_current_answer_key,
+    regrade_quiz,
+    submit_attempt,
+)
+from main.models import (
+    AchieveUser,
+    Comment,
+    CommentFanout,
+    CommentImage,
+    Course,
+    CourseEnrollment,
+    Module,
+    Notification,
+    PendingMediaDeletion,
+    Question,
+    Quiz,
+    QuizAttempt,
+    QuizAttemptState,
+)
 
-# Create your tests here.
+
+def create_user(email, **extra_fields):
+    return AchieveUser.objects.create_user(
+        email=email,
+        password="password",
+        first_name="Test",
+        last_name="User",
+        **extra_fields,
+    )
+
+
+def create_quiz(creator, question_count, **extra_fields):
+    course = Course.objects.create(
+        course_title="Course", description="Description", creator=creator
+    )
+    module = Module.objects.create(course=course, module_title="Module", topic="Topic")
+    quiz = Quiz.objects.create(
+        quiz_title="Quiz",
+        module=module,
+        quiz_description="Description",
+        total_mark=question_count,
+        **extra_fields,
+    )
+    Question.objects.bulk_create(
+        [
+            Question(
+                quiz=quiz,
+                question_point=1,
+                question_text=f"Question {i}",
+                question_type="TF",
+                correct_answer="True",
+                choices=["True", "False"],
+            )
+            for i in range(question_count)
+        ]
+    )
+    return quiz
+
+
+class SubmitAnswersTests(TestCase):
+    def setUp(self):
+        get_answer_key.cache_clear()
+        self.student = create_user("student@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def submit(self, quiz):
+        question_ids = quiz.questions.order_by("id").values_list("id", flat=True)
+        answers = [
+            {"question_id": question_id, "answer_text": "True" if i % 2 else "False"}
+            for i, question_id in enumerate(question_ids)
+        ]
+        return self.client.post(
+            f"/submit_answers/{quiz.id}", {"answers": answers}, format="json"
+        )
+
+    def test_query_count_does_not_depend_on_question_count(self):
+        query_counts = []
+        for question_count in (5, 60):
+            quiz = create_quiz(self.student, question_count)
+            # The first submission compiles the answer key
+            self.submit(quiz)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.submit(quiz)
+            self.assertEqual(response.status_code, 201, response.content)
+            attempt = QuizAttempt.objects.get(id=response.json()["id"])
+            self.assertEqual(attempt.score, question_count // 2)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_duplicate_answers_are_rejected(self):
+        quiz = create_quiz(self.student, 3)
+        question_id = quiz.questions.values_list("id", flat=True).first()
+        answers = [{"question_id": question_id, "answer_text": "True"}] * 10
+        response = self.client.post(
+            f"/submit_answers/{quiz.id}", {"answers": answers}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(QuizAttempt.objects.filter(quiz=quiz).exists())
+
+
+class QuizVersionTests(TestCase):
+    def setUp(self):
+        get_answer_key.cache_clear()
+
+    def test_stale_save_does_not_lower_the_version(self):
+        quiz = create_quiz(create_user("teacher@example.com"), 1)
+        stale = Quiz.objects.get(id=quiz.id)
+        question = quiz.questions.get()
+        question.correct_answer = "False"
+        question.save()
+        self.assertEqual(
+            get_current_answer_key(quiz.id).entries[question.id].correct_answer,
+            "false",
+        )
+        question.correct_answer = "True"
+        question.save()
+        version = Quiz.objects.get(id=quiz.id).version
+        stale.quiz_title = "Renamed"
+        stale.save()
+        self.assertEqual(stale.version, version + 1)
+        self.assertEqual(Quiz.objects.get(id=quiz.id).version, version + 1)
+        self.assertEqual(
+            get_current_answer_key(quiz.id).entries[question.id].correct_answer,
+            "true",
+        )
+
+
+class GetQuizzesTests(TestCase):
+    def setUp(self):
+        self.instructor = create_user("instructor@example.com")
+        self.instructor.groups.add(Group.objects.create(name="Instructors"))
+        self.quiz = create_quiz(self.instructor, 2)
+        self.client = APIClient()
+
+    def get_questions(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get(f"/quizzes/{self.quiz.module_id}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["quizzes"][0]["questions"]
+
+    def test_students_do_not_receive_correct_answers(self):
+        questions = self.get_questions(create_user("student@example.com"))
+        self.assertEqual(len(questions), 2)
+        self.assertTrue(all("correct_answer" not in question for question in questions))
+
+    def test_editors_receive_correct_answers(self):
+        questions = self.get_questions(self.instructor)
+        self.assertTrue(
+            all(question["correct_answer"] == "True" for question in questions)
+        )
+
+    def test_summary(self):
+        Quiz.objects.create(
+            quiz_title="Empty",
+            module=self.quiz.module,
+            quiz_description="Description",
+            total_mark=0,
+        )
+        self.client.force_authenticate(create_user("student@example.com"))
+        response = self.client.get(f"/quizzes/{self.quiz.module_id}?summary=1")
+        self.assertEqual(response.status_code, 200)
+        quizzes = response.json()["quizzes"]
+        self.assertEqual(
+            [
+                (quiz["quiz_title"], quiz["question_count"], quiz["question_marks"])
+                for quiz in quizzes
+            ],
+            [("Quiz", 2, 2), ("Empty", 0, 0)],
+        )
+        self.assertTrue(all("questions" not in quiz for quiz in quizzes))
+
+    def test_query_count_does_not_depend_on_quiz_count(self):
+        for summary in ("0", "1"):
+            query_counts = []
+            for quiz_count in (1, 10):
+                quizzes = [create_quiz(self.instructor, 3) for _ in range(quiz_count)]
+                module = quizzes[0].module
+                Quiz.objects.filter(id__in=[quiz.id for quiz in quizzes]).update(
+                    module=module
+                )
+                # A fresh user, roles are looked up once per user object
+                self.client.force_authenticate(
+                    AchieveUser.objects.get(id=self.instructor.id)
+                )
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(
+                        f"/quizzes/{module.id}?summary={summary}"
+                    )
+                self.assertEqual(len(response.json()["quizzes"]), quiz_count)
+                query_counts.append(len(queries))
+            self.assertEqual(query_counts[0], query_counts[1])
+
+
+class GetQuizByIdTests(TestCase):
+    def setUp(self):
+        # Payloads are cached by quiz id, which test databases reuse
+        cache.clear()
+        self.instructor = create_user("instructor@example.com", is_staff=True)
+        self.quiz = create_quiz(self.instructor, 2)
+        self.client = APIClient()
+        self.client.force_authenticate(create_user("student@example.com"))
+
+    def get_quiz(self, **headers):
+        return self.client.get(f"/quiz/{self.quiz.id}", headers=headers)
+
+    def test_unchanged_quiz_is_not_modified(self):
+        response = self.get_quiz()
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+        questions = response.json()["questions"]
+        self.assertEqual(len(questions), 2)
+        self.assertTrue(all("correct_answer" not in question for question in questions))
+
+        response = self.get_quiz(if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+        # An edit bumps the version and so the ETag
+        self.quiz.quiz_title = "Renamed"
+        self.quiz.save()
+        response = self.get_quiz(if_none_match=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()["quiz"]["quiz_title"], "Renamed")
+
+    def test_editors_get_their_own_payload(self):
+        student_etag = self.get_quiz()["ETag"]
+        self.client.force_authenticate(self.instructor)
+        response = self.get_quiz(if_none_match=student_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(
+            all(
+                question["correct_answer"] == "True"
+                for question in response.json()["questions"]
+            )
+        )
+
+
+@skipUnlessDBFeature("has_select_for_update")
+class ConcurrentSubmitTests(TransactionTestCase):
+    def setUp(self):
+        get_answer_key.cache_clear()
+
+    def test_concurrent_submissions_respect_attempts_allowed(self):
+        student = create_user("student@example.com")
+        quiz = create_quiz(student, 3, attempts_allowed=3)
+        answers = [
+            {"question_id": question_id, "answer_text": "True"}
+            for question_id in quiz.questions.values_list("id", flat=True)
+        ]
+        submissions = 8
+        barrier = threading.Barrier(submissions)
+        errors = []
+
+        def submit():
+            try:
+                barrier.wait()
+                submit_attempt(quiz.id, student, answers)
+            except serializers.ValidationError:
+                pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=submit) for _ in range(submissions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        attempt_numbers = list(
+            QuizAttempt.objects.filter(quiz=quiz, taken_by=student).values_list(
+                "total_attempts", flat=True
+            )
+        )
+        self.assertEqual(sorted(attempt_numbers), [1, 2, 3])
+        state = QuizAttemptState.objects.get(quiz=quiz, user=student)
+        self.assertEqual(state.attempts_taken, 3)
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        get_answer_key.cache_clear()
+        self.client = APIClient()
+
+    def get_leaderboard(self, quiz, user, limit):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/quiz_leaderboard/{quiz.id}?limit={limit}")
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(queries)
+
+    def test_equal_scores_share_a_rank(self):
+        students = [create_user(f"student{i}@example.com") for i in range(5)]
+        quiz = create_quiz(students[0], 4)
+        question_ids = list(quiz.questions.order_by("id").values_list("id", flat=True))
+        for student, score in zip(students, [3, 1, 3, 0, 2]):
+            submit_attempt(
+                quiz.id,
+                student,
+                [
+                    {"question_id": question_id, "answer_text": "True"}
+                    for question_id in question_ids[:score]
+                ],
+            )
+            # A worse later attempt does not lower the best score
+            submit_attempt(quiz.id, student, [])
+        data, _ = self.get_leaderboard(quiz, students[4], 4)
+        self.assertEqual([entry["rank"] for entry in data["leaderboard"]], [1, 1, 3, 4])
+        self.assertEqual(
+            [entry["best_score"] for entry in data["leaderboard"]], [3, 3, 2, 1]
+        )
+        self.assertEqual((data["my_rank"], data["my_best_score"]), (3, 2))
+
+    def test_query_count_does_not_depend_on_attempt_count(self):
+        query_counts = []
+        for student_count in (10, 5000):
+            quiz = create_quiz(None, 1)
+            students = AchieveUser.objects.bulk_create(
+                [
+                    AchieveUser(
+                        email=f"quiz{quiz.id}-student{i}@example.com",
+                        username=f"quiz{quiz.id}-student{i}",
+                        first_name="Student",
+                        last_name=str(i),
+                    )
+                    for i in range(student_count)
+                ]
+            )
+            QuizAttemptState.objects.bulk_create(
+                [
+                    QuizAttemptState(
+                        quiz=quiz,
+                        user=student,
+                        attempts_taken=1,
+                        best_score=i % 100,
+                        best_scored_at=timezone.now(),
+                    )
+                    for i, student in enumerate(students)
+                ]
+            )
+            data, query_count = self.get_leaderboard(quiz, students[0], 100)
+            self.assertEqual(len(data["leaderboard"]), min(student_count, 100))
+            self.assertEqual(
+                data["leaderboard"][0]["best_score"], 99 if student_count > 100 else 9
+            )
+            query_counts.append(query_count)
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_invalid_limit(self):
+        student = create_user("student@example.com")
+        quiz = create_quiz(student, 1)
+        self.client.force_authenticate(student)
+        for limit in ("-5", "0", "ten"):
+            response = self.client.get(f"/quiz_leaderboard/{quiz.id}?limit={limit}")
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(
+                response.json(), {"error": "limit must be a positive integer"}
+            )
+
+
+class QuizAnalyticsTests(TestCase):
+    def setUp(self):
+        get_answer_key.cache_clear()
+        self.instructor = create_user("instructor@example.com", is_staff=True)
+        self.quiz = create_quiz(self.instructor, 2)
+        self.question_ids = list(
+            self.quiz.questions.order_by("id").values_list("id", flat=True)
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.instructor)
+
+    def submit(self, student, correct):
+        return submit_attempt(
+            self.quiz.id,
+            student,
+            [
+                {"question_id": question_id, "answer_text": "True"}
+                for question_id in self.question_ids[:correct]
+            ],
+        )
+
+    def get_stats(self):
+        response = self.client.get(f"/quiz_analytics/{self.quiz.id}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_attempts_are_counted_once(self):
+        self.submit(create_user("first@example.com"), 2)
+        self.submit(create_user("second@example.com"), 1)
+        self.get_stats()
+        data = self.get_stats()
+        self.assertEqual(data["quiz"]["attempt_count"], 2)
+        self.assertEqual(data["quiz"]["score_histogram"], {"2": 1, "1": 1})
+        self.assertEqual(
+            [question["correct_count"] for question in data["questions"]], [2, 1]
+        )
+
+    def test_late_commits_are_counted(self):
+        late = self.submit(create_user("late@example.com"), 1)
+        # Stand in for an attempt with a lower id whose transaction commits
+        # after a later attempt has been aggregated
+        QuizAttempt.objects.filter(id=late.id).delete()
+        self.submit(create_user("early@example.com"), 2)
+        self.assertEqual(self.get_stats()["quiz"]["attempt_count"], 1)
+        late.save(force_insert=True)
+        self.assertEqual(self.get_stats()["quiz"]["attempt_count"], 2)
+
+    def test_regrade_recounts_every_attempt(self):
+        self.submit(create_user("student@example.com"), 2)
+        self.get_stats()
+        self.quiz.questions.update(correct_answer="False")
+        Quiz.objects.get(id=self.quiz.id).save()
+        regrade_quiz(self.quiz.id)
+        data = self.get_stats()
+        self.assertEqual(data["quiz"]["attempt_count"], 1)
+        self.assertEqual(data["quiz"]["score_histogram"], {"0": 1})
+
+
+class ExportGradebookTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.instructor = create_user("instructor@example.com", is_staff=True)
+        cls.quiz = create_quiz(cls.instructor, 2)
+        cls.course_ids = {}
+        for student_count in (2000, 20000):
+            quiz = create_quiz(cls.instructor, 2)
+            course_id = quiz.module.course_id
+            students = AchieveUser.objects.bulk_create(
+                [
+                    AchieveUser(
+                        email=f"course{course_id}-student{i}@example.com",
+                        username=f"course{course_id}-student{i}",
+                        first_name="Student",
+                        last_name=str(i),
+                    )
+                    for i in range(student_count)
+                ]
+            )
+            CourseEnrollment.objects.bulk_create(
+                [
+                    CourseEnrollment(
+                        course_id=course_id, user=student, enrolled_by=cls.instructor
+                    )
+                    for student in students
+                ]
+            )
+            QuizAttemptState.objects.bulk_create(
+                [
+                    QuizAttemptState(
+                        quiz=quiz, user=student, attempts_taken=1, best_score=i % 3
+                    )
+                    for i, student in enumerate(students)
+                ]
+            )
+            cls.course_ids[student_count] = course_id
+
+    async def export(self, course_id):
+        """Stream an export through the ASGI handler, return (lines, peak memory)."""
+        token = await sync_to_async(
+            lambda: str(RefreshToken.for_user(self.instructor).access_token)
+        )()
+        tracemalloc.start()
+        try:
+            response = await AsyncClient().get(
+                f"/gradebook/{course_id}?export=csv",
+                headers={"Authorization": f"Bearer {token}"},
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            lines = 0
+            async for chunk in response.streaming_content:
+                lines += chunk.count(b"\n")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return lines, peak
+
+    async def test_memory_does_not_grow_with_the_gradebook(self):
+        small_lines, small_peak = await self.export(self.course_ids[2000])
+        large_lines, large_peak = await self.export(self.course_ids[20000])
+        self.assertEqual(small_lines, 2001)
+        self.assertEqual(large_lines, 20001)
+        # Ten times the students, about the same peak
+        self.assertLess(large_peak, small_peak * 2)
+
+
+class ImportQuizzesTests(TestCase):
+    def setUp(self):
+        instructor = create_user("instructor@example.com", is_staff=True)
+        self.module = create_quiz(instructor, 0).module
+        self.client = APIClient()
+        self.client.force_authenticate(instructor)
+
+    def post(self, name, content):
+        return self.client.post(
+            "/import_quizzes",
+            {"module_id": self.module.id, "file": SimpleUploadedFile(name, content)},
+            format="multipart",
+        )
+
+    def test_files_that_are_not_utf8_are_rejected(self):
+        csv_content = (
+            "quiz_title,question_text,question_type,correct_answer,question_point\n"
+            "Caf\xe9,Question,TF,True,1\n"
+        ).encode("latin-1")
+        jsonl_content = '{"quiz_title": "Caf\xe9"}\n'.encode("latin-1")
+        for name, content in (("bank.csv", csv_content), ("bank.jsonl", jsonl_content)):
+            response = self.post(name, content)
+            self.assertEqual(response.status_code, 400, response.content)
+            self.assertEqual(
+                response.json()["errors"],
+                [{"row": 0, "errors": {"error": "The file is not valid UTF-8"}}],
+            )
+        self.assertEqual(Quiz.objects.filter(module=self.module).count(), 1)
+
+
+class GetQuizResultsTests(TestCase):
+    def setUp(self):
+        get_answer_key.cache_clear()
+        self.student = create_user("student@example.com")
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    @override_settings(QUIZ_COMPACT_ANSWERS=True)
+    def test_packed_answers_to_deleted_questions_are_reported(self):
+        quiz = create_quiz(self.student, 2)
+        first, second = quiz.questions.order_by("id")
+        attempt = submit_attempt(
+            quiz.id,
+            self.student,
+            [
+                {"question_id": first.id, "answer_text": "True"},
+                {"question_id": second.id, "answer_text": "False"},
+            ],
+        )
+        graded_version = Quiz.objects.get(id=quiz.id).version
+        deleted_id = second.id
+        second.delete()
+        response = self.client.get(f"/quiz_results/{attempt.id}")
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            [answer["question_id"] for answer in data["answers"]],
+            [first.id, deleted_id],
+        )
+        self.assertEqual(data["questions"][0]["id"], first.id)
+        self.assertIsNone(data["questions"][1])
+        self.assertEqual(data["missing_question_ids"], [deleted_id])
+        self.assertEqual(data["quiz_version"], graded_version)
+        self.assertEqual(data["current_quiz_version"], graded_version + 1)
+
+    @override_settings(QUIZ_COMPACT_ANSWERS=True)
+    def test_regrade_updates_flags_when_the_score_is_unchanged(self):
+        quiz = create_quiz(self.student, 2)
+        first, second = quiz.questions.order_by("id")
+        attempt = submit_attempt(
+            quiz.id,
+            self.student,
+            [
+                {"question_id": first.id, "answer_text": "True"},
+                {"question_id": second.id, "answer_text": "False"},
+            ],
+        )
+        # Both answers flip, the score stays 1
+        quiz.questions.update(correct_answer="False")
+        Quiz.objects.get(id=quiz.id).save()
+        self.assertEqual(regrade_quiz(quiz.id), 0)
+        self.assertEqual(QuizAttempt.objects.get(id=attempt.id).score, 1)
+        data = self.client.get(f"/quiz_results/{attempt.id}").json()
+        self.assertEqual(
+            [answer["is_correct"] for answer in data["answers"]], [False, True]
+        )
+
+
+class GetCommentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.instructor = create_user("instructor@example.com")
+        cls.instructor.groups.add(Group.objects.create(name="Instructors"))
+        cls.student = create_user("student@example.com")
+        cls.other_student = create_user("other@example.com")
+
+    def create_lesson(self, thread_count):
+        """A lesson with broadcasts and both students' questions, each answered."""
+        lesson = create_quiz(self.instructor, 0).module
+        authors = [self.instructor, self.student, self.other_student]
+        threads = Comment.objects.bulk_create(
+            [
+                Comment(
+                    lesson=lesson,
+                    commentor=authors[i % 3],
+                    comment=f"Thread {i}",
+                    commented_at=timezone.now(),
+                )
+                for i in range(thread_count)
+            ]
+        )
+        Comment.objects.bulk_create(
+            [
+                Comment(
+                    lesson=lesson,
+                    commentor=self.instructor,
+                    reply_to=thread,
+                    comment=f"Reply to {thread.comment}",
+                    commented_at=timezone.now(),
+                )
+                for thread in threads
+            ]
+        )
+        return lesson
+
+    def get_threads(self, lesson, user):
+        client = APIClient()
+        client.force_authenticate(AchieveUser.objects.get(id=user.id))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(f"/comments/{lesson.id}?nested=1")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["comments"], len(queries)
+
+    def test_large_lesson(self):
+        small_lesson = self.create_lesson(9)
+        large_lesson = self.create_lesson(5001)
+
+        threads, small_queries = self.get_threads(small_lesson, self.student)
+        threads, large_queries = self.get_threads(large_lesson, self.student)
+        self.assertEqual(small_queries, large_queries)
+        # Broadcasts and the student's own threads, never the other student's
+        self.assertEqual(len(threads), 3334)
+        self.assertEqual(
+            {thread["commentor"]["id"] for thread in threads},
+            {self.instructor.id, self.student.id},
+        )
+        for thread in threads:
+            # Students only see the replies in their own threads
+            expected_replies = []
+            if thread["commentor"]["id"] == self.student.id:
+                expected_replies = [f"Reply to {thread['comment']}"]
+            self.assertEqual(
+                [reply["comment"] for reply in thread["replies"]], expected_replies
+            )
+
+        threads, small_queries = self.get_threads(small_lesson, self.instructor)
+        threads, large_queries = self.get_threads(large_lesson, self.instructor)
+        self.assertEqual(small_queries, large_queries)
+        self.assertEqual(len(threads), 5001)
+        self.assertEqual(sum(len(thread["replies"]) for thread in threads), 5001)
+
+    def test_thread_pages(self):
+        lesson = self.create_lesson(7)
+        # Equal timestamps are ordered by id
+        Comment.objects.filter(
+            lesson=lesson, comment__in=["Thread 2", "Thread 3"]
+        ).update(
+            commented_at=Comment.objects.get(
+                lesson=lesson, comment="Thread 4"
+            ).commented_at
+        )
+        client = APIClient()
+        client.force_authenticate(self.instructor)
+        seen = []
+        cursor = ""
+        while True:
+            response = client.get(f"/comments/{lesson.id}?limit=3&cursor={cursor}")
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            self.assertLessEqual(len(data["comments"]), 3)
+            seen += [thread["comment"] for thread in data["comments"]]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f"Thread {i}" for i in reversed(range(7))])
+
+    def test_invalid_page_params(self):
+        lesson = self.create_lesson(1)
+        client = APIClient()
+        client.force_authenticate(self.instructor)
+        for query, error in [
+            ("limit=ten", "limit must be a positive integer"),
+            ("limit=0", "limit must be a positive integer"),
+            ("cursor=not-a-cursor", "Invalid cursor"),
+            (f"cursor={utils.encode_cursor(timezone.now(), 1)[:-4]}", "Invalid cursor"),
+        ]:
+            response = client.get(f"/comments/{lesson.id}?{query}")
+            self.assertEqual(response.status_code, 400, query)
+            self.assertEqual(response.json(), {"error": error})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), COMMENT_IMAGE_MAX_UPLOAD_SIZE=20000)
+class AddCommentImagesTests(TestCase):
+    def setUp(self):
+        self.student = create_user("student@example.com")
+        self.lesson = create_quiz(self.student, 0).module
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def png(self, name, size=(10, 10)):
+        output = io.BytesIO()
+        Image.effect_noise(size, 64).convert("RGB").save(output, "PNG")
+        return SimpleUploadedFile(name, output.getvalue(), content_type="image/png")
+
+    def post(self, images):
+        return self.client.post(
+            "/add_comment",
+            {"lesson_id": self.lesson.id, "comment": "Look", "images": images},
+            format="multipart",
+        )
+
+    def assertRejected(self, images, error):
+        response = self.post(images)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"images": [error]})
+        self.assertFalse(Comment.objects.exists())
+
+    def test_images_within_the_limits(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post(
+                [self.png(f"{i}.png") for i in range(CommentImage.MAX_IMAGES)]
+            )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(CommentImage.objects.count(), CommentImage.MAX_IMAGES)
+        # The images are inserted together, not one query each
+        self.assertLess(len(queries), 10)
+
+    def test_too_many_images(self):
+        self.assertRejected(
+            [self.png(f"{i}.png") for i in range(CommentImage.MAX_IMAGES + 1)],
+            f"Cannot add more than {CommentImage.MAX_IMAGES} images to a comment.",
+        )
+
+    def test_not_an_image(self):
+        self.assertRejected(
+            [SimpleUploadedFile("notes.txt", b"notes", content_type="text/plain")],
+            "notes.txt is not a JPEG, PNG, GIF or WebP image.",
+        )
+        self.assertRejected(
+            [SimpleUploadedFile("fake.png", b"not a png", content_type="image/png")],
+            "fake.png is not a valid image.",
+        )
+
+    def test_too_large(self):
+        self.assertRejected(
+            [self.png("large.png", (200, 200))], "large.png is larger than 19.5\xa0KB."
+        )
+
+    def test_limit_counts_existing_images(self):
+        comment = Comment.objects.create(
+            lesson=self.lesson, commentor=self.student, comment="Look"
+        )
+        CommentImage.add_to_comment(comment, [self.png("first.png")])
+        with self.assertRaises(ValidationError):
+            CommentImage.add_to_comment(
+                comment,
+                [self.png(f"{i}.png") for i in range(CommentImage.MAX_IMAGES)],
+            )
+        self.assertEqual(comment.images.count(), 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DeleteCommentTests(TestCase):
+    def setUp(self):
+        self.student = create_user("student@example.com")
+        self.lesson = create_quiz(self.student, 0).module
+
+    def create_thread(self, reply_count):
+        """A thread with reply_count replies, each with a nested reply and an image."""
+        thread = Comment.objects.create(
+            lesson=self.lesson, commentor=self.student, comment="Thread"
+        )
+        for i in range(reply_count):
+            reply = Comment.objects.create(
+                lesson=self.lesson,
+                commentor=self.student,
+                reply_to=thread,
+                comment=f"Reply {i}",
+            )
+            nested = Comment.objects.create(
+                lesson=self.lesson,
+                commentor=self.student,
+                reply_to=reply,
+                comment=f"Nested reply {i}",
+            )
+            image = CommentImage(comment=nested)
+            image.image.save(f"{i}.png", ContentFile(b"image"))
+        return thread
+
+    def test_subtree_is_deleted_in_bulk(self):
+        kept = Comment.objects.create(
+            lesson=self.lesson, commentor=self.student, comment="Other"
+        )
+        query_counts = []
+        for reply_count in (2, 20):
+            thread = self.create_thread(reply_count)
+            paths = list(
+                CommentImage.objects.filter(
+                    comment__reply_to__reply_to=thread
+                ).values_list("image", flat=True)
+            )
+            with CaptureQueriesContext(connection) as queries:
+                thread.delete()
+            query_counts.append(len(queries))
+            self.assertFalse(
+                Comment.objects.filter(lesson=self.lesson).exclude(id=kept.id).exists()
+            )
+            self.assertFalse(CommentImage.objects.exists())
+            # Files stay until they are collected
+            self.assertEqual(
+                sorted(PendingMediaDeletion.objects.values_list("path", flat=True)),
+                sorted(paths),
+            )
+            self.assertTrue(all(default_storage.exists(path) for path in paths))
+            self.assertEqual(media.collect_deleted_media(), reply_count)
+            self.assertFalse(any(default_storage.exists(path) for path in paths))
+            self.assertFalse(PendingMediaDeletion.objects.exists())
+        self.assertEqual(query_counts[0], query_counts[1])
+
+    def test_view_schedules_collection_after_commit(self):
+        thread = self.create_thread(1)
+        client = APIClient()
+        client.force_authenticate(self.student)
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = client.delete(f"/delete_comment/{thread.id}")
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Comment.objects.filter(lesson=self.lesson).exists())
+        self.assertEqual(PendingMediaDeletion.objects.count(), 1)
+        self.assertEqual(len(callbacks), 1)
+
+
+class UnansweredCommentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.instructor = create_user("instructor@example.com")
+        cls.instructor.groups.add(Group.objects.create(name=roles.INSTRUCTORS))
+        cls.staff = create_user("staff@example.com", is_staff=True)
+        cls.student = create_user("student@example.com")
+        cls.lesson = create_quiz(cls.instructor, 0).module
+        # A course the instructor neither created nor is enrolled in
+        cls.other_lesson = create_quiz(cls.staff, 0).module
+
+    def request(self, user, method, path, data=None):
+        client = APIClient()
+        client.force_authenticate(AchieveUser.objects.get(id=user.id))
+        return getattr(client, method)(path, data)
+
+    def add_comment(self, user, lesson, reply_to=None):
+        data = {"lesson_id": lesson.id, "comment": "Question"}
+        if reply_to is not None:
+            data["reply_to_id"] = reply_to.id
+        response = self.request(user, "post", "/add_comment", data)
+        self.assertEqual(response.status_code, 201, response.content)
+        return Comment.objects.latest("id")
+
+    def inbox(self, user):
+        response = self.request(user, "get", "/unanswered_comments")
+        self.assertEqual(response.status_code, 200)
+        return [comment["id"] for comment in response.json()["comments"]]
+
+    def test_inbox(self):
+        question = self.add_comment(self.student, self.lesson)
+        other_question = self.add_comment(self.student, self.other_lesson)
+        broadcast = self.add_comment(self.instructor, self.lesson)
+        self.assertTrue(broadcast.answered)
+        # A student's follow-up does not answer the question
+        self.add_comment(self.student, self.lesson, question)
+
+        self.assertEqual(self.inbox(self.instructor), [question.id])
+        self.assertEqual(self.inbox(self.staff), [other_question.id, question.id])
+        response = self.request(self.student, "get", "/unanswered_comments")
+        self.assertEqual(response.status_code, 403)
+
+        reply = self.add_comment(self.instructor, self.lesson, question)
+        question.refresh_from_db()
+        self.assertTrue(question.answered)
+        self.assertEqual(self.inbox(self.instructor), [])
+
+        # Deleting the only editor reply reopens the question
+        response = self.request(
+            self.instructor, "delete", f"/delete_comment/{reply.id}"
+        )
+        self.assertEqual(response.status_code, 204)
+        question.refresh_from_db()
+        self.assertFalse(question.answered)
+        self.assertEqual(self.inbox(self.instructor), [question.id])
+
+
+class UnreadCommentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.editor = create_user("editor@example.com", is_staff=True)
+        cls.student = create_user("student@example.com")
+        other_student = create_user("other@example.com")
+        cls.lesson = create_quiz(cls.editor, 0).module
+        cls.other_lesson = Module.objects.create(
+            course=cls.lesson.course, module_title="Other", topic="Topic"
+        )
+        Comment.objects.create(lesson=cls.lesson, commentor=cls.editor, comment="News")
+        question = Comment.objects.create(
+            lesson=cls.lesson, commentor=cls.student, comment="Question"
+        )
+        Comment.objects.create(
+            lesson=cls.lesson, commentor=cls.editor, reply_to=question, comment="Answer"
+        )
+        Comment.objects.create(
+            lesson=cls.other_lesson, commentor=other_student, comment="Hidden"
+        )
+
+    def unread(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(f"/unread_comments/{self.lesson.course_id}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["unread"]
+
+    def test_unread_counts(self):
+        # Not their own question nor the other student's thread
+        self.assertEqual(self.unread(self.student), {str(self.lesson.id): 2})
+        # Not the editor's own broadcast and answer
+        self.assertEqual(
+            self.unread(self.editor),
+            {str(self.lesson.id): 1, str(self.other_lesson.id): 1},
+        )
+
+    def test_marking_a_lesson_read(self):
+        client = APIClient()
+        client.force_authenticate(self.student)
+        response = client.post(f"/mark_lesson_read/{self.lesson.id}")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.unread(self.student), {})
+        Comment.objects.create(
+            lesson=self.lesson, commentor=self.editor, comment="More news"
+        )
+        self.assertEqual(self.unread(self.student), {str(self.lesson.id): 1})
+        # Marking again moves the existing marker
+        client.post(f"/mark_lesson_read/{self.lesson.id}")
+        self.assertEqual(self.unread(self.student), {})
+        response = client.post("/mark_lesson_read/0")
+        self.assertEqual(response.status_code, 404)
+
+
+class CommentFanoutTests(TestCase):
+    def test_failed_fanout_is_not_retried_in_the_same_run(self):
+        student = create_user("student@example.com")
+        lesson = create_quiz(student, 0).module
+        comment = Comment.objects.create(lesson=lesson, commentor=student, comment="Hi")
+        fanout = CommentFanout.objects.create(comment=comment)
+        with mock.patch(
+            "main.fanout.plan_comment_fanout", side_effect=RuntimeError("boom")
+        ), self.assertLogs("main.fanout", "ERROR"):
+            self.assertEqual(dispatch_pending_fanouts(), 0)
+        fanout.refresh_from_db()
+        self.assertEqual(fanout.attempts, 1)
+        self.assertEqual(fanout.last_error, "boom")
+        self.assertIsNone(fanout.dispatched_at)
+        # The next run picks it up again
+        self.assertEqual(dispatch_pending_fanouts(), 1)
+
+    def test_failed_side_effects_do_not_block_later_fanouts(self):
+        student = create_user("student@example.com")
+        lesson = create_quiz(student, 0).module
+        poison, comment = [
+            Comment.objects.create(lesson=lesson, commentor=student, comment=text)
+            for text in ("Poison", "Hi")
+        ]
+        poison_fanout = CommentFanout.objects.create(comment=poison)
+        fanout = CommentFanout.objects.create(comment=comment)
+
+        def index_documents(documents):
+            if any(document.comment_id == poison.id for document in documents):
+                raise RuntimeError("boom")
+
+        with mock.patch(
+            "main.fanout.index_documents", side_effect=index_documents
+        ), self.assertLogs("main.fanout", "ERROR"):
+            self.assertEqual(dispatch_pending_fanouts(), 1)
+            self.assertEqual(dispatch_pending_fanouts(), 0)
+        fanout.refresh_from_db()
+        self.assertIsNotNone(fanout.dispatched_at)
+        poison_fanout.refresh_from_db()
+        self.assertIsNone(poison_fanout.dispatched_at)
+        # Every run records its attempt, so the fan-out is eventually given up
+        self.assertEqual(poison_fanout.attempts, 2)
+        self.assertEqual(poison_fanout.last_error, "boom")
+
+
+class RunInBackgroundTests(TestCase):
+    def test_failures_are_logged(self):
+        def fail():
+            raise RuntimeError("boom")
+
+        with self.assertLogs("main.utils", "ERROR") as logs:
+            future = utils.run_in_background(fail)
+            with self.assertRaises(RuntimeError):
+                future.result()
+        self.assertIn("fail failed", logs.output[0])
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProcessCommentImagesTests(TestCase):
+    def setUp(self):
+        student = create_user("student@example.com")
+        lesson = create_quiz(student, 0).module
+        self.comment = Comment.objects.create(
+            lesson=lesson, commentor=student, comment="Look"
+        )
+
+    def add_image(self, name, data):
+        image = CommentImage(comment=self.comment)
+        image.image.save(name, ContentFile(data))
+        return image
+
+    def png(self):
+        output = io.BytesIO()
+        Image.new("RGB", (400, 200), "red").save(output, "PNG")
+        return output.getvalue()
+
+    def test_undecodable_images_are_not_retried(self):
+        image = self.add_image("broken.png", b"\x89PNG\r\n\x1a\n not an image")
+        with self.assertLogs("main.media", "ERROR"):
+            media.process_comment_images()
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height), (0, 0))
+
+    def test_metadata_is_stripped_from_the_original(self):
+        exif = Image.Exif()
+        exif[0x010F] = "Phone"
+        exif.get_ifd(0x8825)[2] = (48.0, 51.0, 24.0)
+        output = io.BytesIO()
+        Image.new("RGB", (400, 200), "red").save(output, "JPEG", exif=exif.tobytes())
+        image = self.add_image("photo.jpg", output.getvalue())
+        upload_name = image.image.name
+        # Not served before it is stripped
+        self.assertIsNone(CommentImageSerializer(image).data["image"])
+
+        media.process_comment_images()
+        image.refresh_from_db()
+        self.assertNotEqual(image.image.name, upload_name)
+        with Image.open(image.image.path) as original:
+            self.assertEqual(original.size, (400, 200))
+            self.assertEqual(dict(original.getexif()), {})
+        data = CommentImageSerializer(image).data
+        self.assertIsNotNone(data["image"])
+        self.assertIsNotNone(data["thumbnail"])
+        self.assertTrue(PendingMediaDeletion.objects.filter(path=upload_name).exists())
+
+    def test_broken_pool_is_replaced(self):
+        pool = media._get_image_pool()
+        pool.submit(int).result()
+        for process in list(pool._processes.values()):
+            process.kill()
+            process.join()
+        image = self.add_image("photo.png", self.png())
+        # Whether the pool is found broken when submitting or when waiting for
+        # the result, the image is left for the next run
+        with self.assertLogs("main.media", "WARNING"):
+            media.process_comment_images()
+        media.process_comment_images()
+        image.refresh_from_db()
+        self.assertEqual((image.width, image.height), (400, 200))
+        self.assertIsNot(media._get_image_pool(), pool)
+
+
+class RolesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.instructors = Group.objects.create(name=roles.INSTRUCTORS)
+        cls.instructor = create_user("instructor@example.com")
+        cls.instructor.groups.add(cls.instructors)
+        cls.lesson = create_quiz(cls.instructor, 0).module
+        cls.thread = Comment.objects.create(
+            lesson=cls.lesson, commentor=cls.instructor, comment="Thread"
+        )
+
+    def request(self, method, path, data=None):
+        """Make a request as the instructor, return (response, role lookups)."""
+        client = APIClient()
+        client.force_authenticate(AchieveUser.objects.get(id=self.instructor.id))
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(path, data)
+        return response, sum('"auth_group"' in query["sql"] for query in queries)
+
+    def test_one_lookup_per_request(self):
+        for _ in range(2):
+            response, lookups = self.request(
+                "post",
+                "/add_comment",
+                {
+                    "lesson_id": self.lesson.id,
+                    "reply_to_id": self.thread.id,
+                    "comment": "Reply",
+                },
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+            self.assertEqual(lookups, 1)
+
+    def test_role_change_is_seen_by_the_next_request(self):
+        response, _ = self.request("get", "/user")
+        self.assertTrue(response.json()["is_instructor"])
+        self.instructor.groups.remove(self.instructors)
+        response, _ = self.request("get", "/user")
+        self.assertFalse(response.json()["is_instructor"])
+        self.instructors.user_set.add(self.instructor)
+        response, _ = self.request("get", "/user")
+        self.assertTrue(response.json()["is_instructor"])
+
+
+class NotificationFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.start = timezone.now() - timedelta(days=1)
+        cls.student = create_user(
+            "student@example.com",
+            last_seen_notifications=cls.start - timedelta(minutes=1),
+        )
+
+    def notify(self, minutes, **fields):
+        return Notification.objects.create(
+            message=f"At {minutes}",
+            created_at=self.start + timedelta(minutes=minutes),
+            **fields,
+        )
+
+    def get_feed(self, user, limit):
+        """Walk every page of the feed, return (messages, unread count, queries per page)."""
+        client = APIClient()
+        messages = []
+        query_counts = []
+        cursor = ""
+        while True:
+            # Roles are memoized on the user, so count them on every page
+            client.force_authenticate(AchieveUser.objects.get(id=user.id))
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(f"/notifications?limit={limit}&cursor={cursor}")
+            self.assertEqual(response.status_code, 200)
+            query_counts.append(len(queries))
+            data = response.json()
+            self.assertLessEqual(len(data["notifications"]), limit)
+            messages += [
+                notification["message"] for notification in data["notifications"]
+            ]
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return messages, data["unread_count"], query_counts
+
+    def test_pages(self):
+        for minutes in range(25):
+            self.notify(minutes, reciever=self.student)
+        # Equal timestamps are ordered by id
+        self.notify(10, reciever=self.student)
+        messages, unread_count, query_counts = self.get_feed(self.student, 10)
+        self.assertEqual(
+            messages,
+            [f"At {minutes}" for minutes in range(24, 10, -1)]
+            + ["At 10", "At 10"]
+            + [f"At {minutes}" for minutes in range(9, -1, -1)],
+        )
+        self.assertEqual(unread_count, 26)
+        # Every page costs the same, however deep it is
+        self.assertEqual(len(set(query_counts)), 1)
+
+        AchieveUser.objects.filter(id=self.student.id).update(
+            last_seen_notifications=self.start + timedelta(minutes=19, seconds=30)
+        )
+        student = AchieveUser.objects.get(id=self.student.id)
+        self.assertEqual(self.get_feed(student, 10)[1], 5)
+
+    def test_audience_streams(self):
+        instructor = create_user(
+            "instructor@example.com",
+            is_staff=True,
+            last_seen_notifications=self.start - timedelta(minutes=1),
+        )
+        enrolled, other = (
+            Course.objects.create(
+                course_title=title, description="Description", creator=instructor
+            )
+            for title in ("Enrolled", "Other")
+        )
+        CourseEnrollment.objects.create(
+            user=self.student, course=enrolled, enrolled_by=instructor
+        )
+        students = Notification.STUDENTS
+        self.notify(0, reciever=self.student)
+        self.notify(1, audience=students, course=enrolled)
+        self.notify(2, audience=students, course=other)
+        self.notify(3, audience=Notification.EDITORS)
+        self.notify(4, reciever=instructor)
+        self.notify(5, audience=students, course=enrolled)
+        self.notify(6, reciever=self.student)
+        self.notify(7, audience=Notification.EDITORS)
+
+        messages, unread_count, _ = self.get_feed(self.student, 2)
+        self.assertEqual(messages, ["At 6", "At 5", "At 1", "At 0"])
+        self.assertEqual(unread_count, 4)
+
+        messages, unread_count, _ = self.get_feed(instructor, 2)
+        self.assertEqual(messages, ["At 7", "At 4", "At 3"])
+        self.assertEqual(unread_count, 3)
+
+    def test_invalid_page_params(self):
+        client = APIClient()
+        client.force_authenticate(self.student)
+        for query in ("limit=-5", "limit=abc", "cursor=garbage"):
+            response = client.get(f"/notifications?{query}")
+            self.assertEqual(response.status_code, 400, query)
+
+
+@override_settings(NOTIFICATION_COALESCE_WINDOW=600, NOTIFICATION_DIGEST=False)
+class CoalesceNotificationsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = create_user("student@example.com")
+        cls.lesson = create_quiz(cls.student, 1).module
+        cls.other_lesson = Module.objects.create(
+            course=cls.lesson.course, module_title="Other", topic="Topic"
+        )
+
+    def save(self, *rows):
+        with transaction.atomic():
+            return notifications.save_notifications(
+                [(notification, f"user_{self.student.id}") for notification in rows]
+            )
+
+    def reply(self, lesson=None, kind=Notification.REPLY):
+        return Notification(
+            reciever=self.student,
+            kind=kind,
+            lesson=lesson or self.lesson,
+            message="New reply",
+        )
+
+    def test_replies_fold_into_one_row(self):
+        self.save(self.reply(), self.reply())
+        self.save(self.reply())
+        notification = Notification.objects.get()
+        self.assertEqual(notification.count, 3)
+        self.assertEqual(
+            notification.message, "3 new replies to your comments in lesson Module"
+        )
+
+    def test_rows_that_do_not_fold(self):
+        self.save(self.reply(), self.reply(self.other_lesson))
+        self.save(
+            self.reply(kind=Notification.BROADCAST),
+            self.reply(kind=Notification.BROADCAST),
+        )
+        self.assertEqual(Notification.objects.count(), 4)
+        self.assertEqual(Notification.objects.filter(count=1).count(), 4)
+
+        # Rows older than the window are left alone
+        Notification.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        self.save(self.reply())
+        self.assertEqual(Notification.objects.count(), 5)
+
+    @override_settings(NOTIFICATION_DIGEST=True)
+    def test_digest(self):
+        saved = self.save(self.reply(), self.reply(kind=Notification.BROADCAST))
+        self.assertEqual(
+            {
+                notification.kind: notification.digest_pending
+                for notification, _ in saved
+            },
+            {Notification.REPLY: True, Notification.BROADCAST: False},
+        )
+        self.assertEqual(notifications.send_notification_digests(), 1)
+        self.assertFalse(Notification.objects.filter(digest_pending=True).exists())
+        self.assertEqual(notifications.send_notification_digests(), 0)
+
+
+class ArchiveNotificationsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.cutoff = timezone.now() - timedelta(days=30)
+        cls.student = create_user(
+            "student@example.com",
+            last_seen_notifications=cls.cutoff + timedelta(days=10),
+        )
+
+    def notify(self, days, **fields):
+        return Notification.objects.create(
+            message=f"Day {days}",
+            created_at=self.cutoff + timedelta(days=days),
+            **fields,
+        )
+
+    def archived_messages(self, out):
+        return [json.loads(line)["message"] for line in out.getvalue().splitlines()]
+
+    def test_archive(self):
+        for days in (-3, -2, -1):
+            self.notify(days, reciever=self.student)
+        self.notify(-1, reciever=self.student, digest_pending=True)
+        self.notify(5, reciever=self.student)
+        self.notify(5, audience=Notification.EDITORS)
+        self.notify(15, reciever=self.student)
+
+        out = io.BytesIO()
+        archived, archived_bytes = notifications.archive_notifications(
+            out, self.cutoff, batch_size=2
+        )
+        self.assertEqual(archived, 3)
+        self.assertEqual(archived_bytes, len(out.getvalue()))
+        self.assertEqual(self.archived_messages(out), ["Day -3", "Day -2", "Day -1"])
+        self.assertEqual(Notification.objects.count(), 4)
+
+        # Personal rows the receiver has seen go too, broadcasts do not
+        out = io.BytesIO()
+        archived, _ = notifications.archive_notifications(out, self.cutoff, seen=True)
+        self.assertEqual(self.archived_messages(out), ["Day 5"])
+        self.assertEqual(
+            sorted(Notification.objects.values_list("message", flat=True)),
+            ["Day -1", "Day 15", "Day 5"],
+        )
+
+    def test_failed_write_keeps_rows(self):
+        self.notify(-1, reciever=self.student)
+        out = mock.Mock()
+        out.write.side_effect = OSError("Disk full")
+        with self.assertRaises(OSError):
+            notifications.archive_notifications(out, self.cutoff)
+        self.assertEqual(Notification.objects.count(), 1)
+
+
+@override_settings(LAST_SEEN_WRITE_INTERVAL=0.2)
+class MarkNotificationsSeenTests(TransactionTestCase):
+    def setUp(self):
+        notifications._last_seen_buffer.clear()
+        notifications._last_seen_written.clear()
+
+    def test_rapid_calls_are_coalesced(self):
+        user = create_user("student@example.com")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(5):
+                response = client.patch("/update_last_seen_notifications")
+                self.assertEqual(response.status_code, 200)
+        updates = [
+            query["sql"]
+            for query in queries
+            if query["sql"].startswith('UPDATE "main_achieveuser"')
+        ]
+        self.assertEqual(len(updates), 1)
+        written = AchieveUser.objects.get(id=user.id).last_seen_notifications
+        buffered = notifications._last_seen_buffer[user.id]
+        self.assertGreater(buffered, written)
+
+        # The timer hands the flush to the background thread
+        timer = notifications._last_seen_timer
+        timer.join()
+        utils.run_in_background(int).result()
+        self.assertEqual(
+            AchieveUser.objects.get(id=user.id).last_seen_notifications, buffered
+        )
+        self.assertEqual(notifications._last_seen_buffer, {})
+
+    def test_stale_writes_are_forgotten(self):
+        users = [create_user(f"student{i}@example.com") for i in range(3)]
+        with mock.patch.object(notifications.time, "monotonic", return_value=100):
+            for user in users[:2]:
+                notifications.mark_notifications_seen(user, timezone.now())
+        with mock.patch.object(notifications.time, "monotonic", return_value=100.1):
+            notifications.mark_notifications_seen(users[2], timezone.now())
+        self.assertEqual(len(notifications._last_seen_written), 3)
+
+        # Once the interval is over, the next write drops the earlier ones
+        with mock.patch.object(notifications.time, "monotonic", return_value=100.2):
+            notifications.mark_notifications_seen(users[0], timezone.now())
+        self.assertEqual(
+            list(notifications._last_seen_written), [users[2].id, users[0].id]
+        )
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.editor = create_user("editor@example.com", is_staff=True)
+        cls.student = create_user("student@example.com")
+        other_student = create_user("other@example.com")
+        cls.course = Course.objects.create(
+            course_title="Enrolled", description="Photosynthesis"
+        )
+        other_course = Course.objects.create(
+            course_title="Other", description="Photosynthesis"
+        )
+        CourseEnrollment.objects.create(
+            course=cls.course, user=cls.student, enrolled_by=cls.editor
+        )
+        lesson = Module.objects.create(
+            course=cls.course, module_title="Plants", topic="Photosynthesis"
+        )
+        other_lesson = Module.objects.create(
+            course=other_course, module_title="Plants", topic="Photosynthesis"
+        )
+
+        def comment(lesson, commentor, reply_to=None):
+            return Comment.objects.create(
+                lesson=lesson,
+                commentor=commentor,
+                reply_to=reply_to,
+                comment="What drives photosynthesis?",
+            )
+
+        cls.broadcast = comment(lesson, cls.editor)
+        cls.own_thread = comment(lesson, cls.student)
+        cls.reply = comment(lesson, cls.editor, cls.own_thread)
+        cls.other_thread = comment(lesson, other_student)
+        cls.other_course_thread = comment(other_lesson, cls.student)
+        index_documents(
+            [
+                comment_document(cls.broadcast, True),
+                comment_document(cls.own_thread, False),
+                comment_document(cls.reply, True),
+                comment_document(cls.other_thread, False),
+                comment_document(cls.other_course_thread, False),
+            ]
+        )
+        cls.lesson = lesson
+
+    def readable(self, user, is_editor):
+        return set(readable_documents(user, is_editor).values_list("kind", "object_id"))
+
+    def test_students_read_their_courses_and_comments(self):
+        self.assertEqual(
+            self.readable(self.student, False),
+            {
+                ("course", self.course.id),
+                ("lesson", self.lesson.id),
+                # Broadcasts, the student's thread and the replies to it
+                ("comment", self.broadcast.id),
+                ("comment", self.own_thread.id),
+                ("comment", self.reply.id),
+            },
+        )
+
+    def test_editors_read_everything(self):
+        readable = self.readable(self.editor, True)
+        self.assertIn(("comment", self.other_thread.id), readable)
+        self.assertIn(("comment", self.other_course_thread.id), readable)
+        self.assertEqual(len(readable), 9)
+
+    def test_invalid_limit(self):
+        client = APIClient()
+        client.force_authenticate(self.student)
+        for limit in ("-5", "0", "ten"):
+            response = client.get(f"/search?q=photosynthesis&limit={limit}")
+            self.assertEqual(response.status_code, 400)
+
+    @skipUnless(connection.vendor == "postgresql", "Postgres text search")
+    def test_search(self):
+        client = APIClient()
+        client.force_authenticate(self.student)
+        response = client.get("/search?q=photosynthesis&kind=comment")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {result["object_id"] for result in response.json()["results"]},
+            {self.broadcast.id, self.own_thread.id, self.reply.id},
+        )
+
+    @skipUnless(connection.vendor == "postgresql", "Postgres text search")
+    def test_search_uses_gin_index(self):
+        with connection.cursor() as cursor:
+            # The test table is too small for the planner to prefer the index
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        plan = (
+            readable_documents(self.student, False)
+            .filter(
+                search_vector=SearchQuery(
+                    "photosynthesis", search_type="websearch", config="english"
+                )
+            )
+            .explain()
+        )
+        self.assertIn("search_document_gin", plan)
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.files.uploadhandler import (
+    StopUpload,
+    TemporaryFileUploadHandler,
+)
+from django.template.defaultfilters import filesizeformat
+from main.models import CommentImage
+
+# Upload handler for comment images. Files are streamed to temporary files
+# chunk by chunk, like Django's default handler for large uploads, and checked
+# while they arrive: the number of images, the declared type, the leading bytes
+# and the size. The first problem stops the upload and is kept in `error`.
+
+IMAGE_SIGNATURES = {
+    "image/jpeg": (b"\xff\xd8\xff",),
+    "image/png": (b"\x89PNG\r\n\x1a\n",),
+    "image/gif": (b"GIF87a", b"GIF89a"),
+    "image/webp": (b"RIFF",),
+}
+
+
+def has_image_signature(content_type, head):
+    if content_type == "image/webp" and head[8:12] != b"WEBP":
+        return False
+    return head.startswith(IMAGE_SIGNATURES[content_type])
+
+
+class CommentImageUploadHandler(TemporaryFileUploadHandler):
+    IMAGE_FIELD = "images"
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.image_count = 0
+        self.error = None
+
+    def stop(self, error):
+        self.error = error
+        # Keep reading (and discarding) the body so the client gets the response
+        raise StopUpload(connection_reset=False)
+
+    def new_file(self, field_name, file_name, content_type, *args, **kwargs):
+        super().new_file(field_name, file_name, content_type, *args, **kwargs)
+        self.is_image = field_name == self.IMAGE_FIELD
+        self.head_checked = False
+        if self.is_image:
+            self.image_count += 1
+            if self.image_count > CommentImage.MAX_IMAGES:
+                self.stop(
+                    f"Cannot add more than {CommentImage.MAX_IMAGES} images to a comment."
+                )
+            if content_type not in IMAGE_SIGNATURES:
+                self.stop(f"{file_name} is not a JPEG, PNG, GIF or WebP image.")
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.is_image:
+            if not self.head_checked:
+                self.head_checked = True
+                if not has_image_signature(self.content_type, raw_data[:12]):
+                    self.stop(f"{self.file_name} is not a valid image.")
+            max_size = settings.COMMENT_IMAGE_MAX_UPLOAD_SIZE
+            if start + len(raw_data) > max_size:
+                self.stop(
+                    f"{self.file_name} is larger than {filesizeformat(max_size)}."
+                )
+        return super().receive_data_chunk(raw_data, start)
@@ -21,13 +21,22 @@ from main.views import (
     DeleteExternalLinkView,
     EditExternalLinkView,
     AddQuizView,
+    ImportQuizzesView,
     GetQuizzesView,
     GetQuizByIdView,
     SubmitAnswersView,
     GetQuizResultsView,
+    GetQuizAnalyticsView,
+    GetQuizLeaderboardView,
+    ExportGradebookView,
     DeleteQuizView,
     AddCommentView,
     GetCommentsView,
+    GetCommentRepliesView,
+    SearchView,
+    GetUnansweredCommentsView,
+    GetUnreadCommentCountsView,
+    MarkLessonReadView,
     DeleteCommentView,
     EnrollUserView,
     GetEnrollmentInfoView,
@@ -65,7 +74,43 @@ urlpatterns = [
         GetQuizResultsView.as_view(),
         name="quiz_results",
     ),
+    path(
+        "quiz_analytics/<int:quiz_id>",
+        GetQuizAnalyticsView.as_view(),
+        name="quiz_analytics",
+    ),
+    path(
+        "quiz_leaderboard/<int:quiz_id>",
+        GetQuizLeaderboardView.as_view(),
+        name="quiz_leaderboard",
+    ),
+    path(
+        "gradebook/<int:course_id>",
+        ExportGradebookView.as_view(),
+        name="gradebook",
+    ),
     path("comments/<int:lesson_id>", GetCommentsView.as_view(), name="comments"),
+    path(
+        "comment_replies/<int:comment_id>",
+        GetCommentRepliesView.as_view(),
+        name="comment_replies",
+    ),
+    path("search", SearchView.as_view(), name="search"),
+    path(
+        "unanswered_comments",
+        GetUnansweredCommentsView.as_view(),
+        name="unanswered_comments",
+    ),
+    path(
+        "unread_comments/<int:course_id>",
+        GetUnreadCommentCountsView.as_view(),
+        name="unread_comments",
+    ),
+    path(
+        "mark_lesson_read/<int:lesson_id>",
+        MarkLessonReadView.as_view(),
+        name="mark_lesson_read",
+    ),
     path(
         "get_enrollments/<int:course_id>",
         GetEnrollmentInfoView.as_view(),
@@ -117,6 +162,7 @@ urlpatterns = [
         name="delete_external_link",
     ),
     path("add_quiz", AddQuizView.as_view(), name="add_quiz"),
+    path("import_quizzes", ImportQuizzesView.as_view(), name="import_quizzes"),
     path(
         "submit_answers/<int:quiz_id>",
         SubmitAnswersView.as_view(),
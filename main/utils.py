@@ -1,5 +1,16 @@
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from asgiref.sync import sync_to_async
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from django.apps import apps
+from django.db import connections
+from django.db.models import Q
 from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
+
+logger = logging.getLogger(__name__)
 
 
 
@@ -19,4 +30,111 @@ def delete_object_by_condition(request, app_label, model_name, **condition):
          return JsonResponse(
             {"message": f"{model_name} successduly deleted"}, status=200
         )
-     return JsonResponse({"message": f"{model_name} not found"}, status=404)
\ No newline at end of file
+     return JsonResponse({"message": f"{model_name} not found"}, status=404)
+
+class Echo:
+    # File-like object for csv.writer that hands each row back instead of buffering it,
+    # used to stream CSV files with StreamingHttpResponse.
+    def write(self, value):
+        return value
+
+
+async def iterate_in_thread(iterable, chunk_size=100):
+    """Iterate a synchronous (e.g. database backed) iterable from async code.
+
+    Under ASGI, StreamingHttpResponse reads a synchronous iterator with
+    sync_to_async(list), building the whole body in memory first. This pulls
+    chunk_size items at a time in the request's sync thread instead, so the
+    iterable's database connection and server-side cursors stay usable.
+    """
+    iterator = iter(iterable)
+    next_chunk = sync_to_async(lambda: list(islice(iterator, chunk_size)))
+    while chunk := await next_chunk():
+        for item in chunk:
+            yield item
+
+
+# Keyset (cursor) pagination over a (timestamp, id) ordering. The cursor is the
+# position of the last row of a page, so every page is an index range scan no
+# matter how deep it is.
+
+
+def encode_cursor(timestamp, pk):
+    raw = json.dumps([timestamp.isoformat(), pk]).encode()
+    return urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, pk = json.loads(urlsafe_b64decode(cursor.encode()))
+        timestamp = parse_datetime(timestamp)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    if timestamp is None or not isinstance(pk, int):
+        raise ValueError("Invalid cursor")
+    return timestamp, pk
+
+
+def parse_limit(query_params, default_limit=20, max_limit=100):
+    """Return the limit from the query string, raising ValueError when invalid."""
+    try:
+        limit = int(query_params.get("limit", default_limit))
+    except (TypeError, ValueError):
+        limit = 0
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, max_limit)
+
+
+def parse_page_params(query_params, default_limit=20, max_limit=100):
+    """Return (cursor, limit) from the query string, raising ValueError when invalid."""
+    limit = parse_limit(query_params, default_limit, max_limit)
+    cursor = query_params.get("cursor")
+    return (decode_cursor(cursor) if cursor else None), limit
+
+
+def paginate_keyset(queryset, field, cursor, limit, descending=True):
+    """Return (rows, next_cursor) for one page of queryset ordered by (field, id)."""
+    if descending:
+        queryset = queryset.order_by(f"-{field}", "-id")
+    else:
+        queryset = queryset.order_by(field, "id")
+    if cursor is not None:
+        timestamp, pk = cursor
+        after = "lt" if descending else "gt"
+        queryset = queryset.filter(
+            Q(**{f"{field}__{after}": timestamp})
+            | Q(**{field: timestamp, f"id__{after}": pk})
+        )
+    rows = list(queryset[: limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(getattr(rows[-1], field), rows[-1].pk)
+    return rows, next_cursor
+
+
+# A single background thread per process for work that should not hold up the
+# response (e.g. dispatching comment fan-outs). Tasks get their own database
+# connection, which is closed once the task is done.
+_background_executor = None
+
+
+def _run_background_task(func, args, kwargs):
+    # Nobody waits on the returned future, failures are only seen in the logs
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Background task %s failed", func.__qualname__)
+        raise
+    finally:
+        connections.close_all()
+
+
+def run_in_background(func, *args, **kwargs):
+    global _background_executor
+    if _background_executor is None:
+        _background_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="background"
+        )
+    return _background_executor.submit(_run_background_task, func, args, kwargs)
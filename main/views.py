@@ -5,16 +5,24 @@ from main.models import (
     Flashcard,
     ExternalLink,
     Quiz,
-    Question,
-    Answer,
     QuizAttempt,
     Comment,
     CourseEnrollment,
     AchieveUser,
     Notification,
+    QuestionStats,
+    SearchDocument,
 )
 from django.shortcuts import get_object_or_404
-from main.utils import delete_object, delete_object_by_condition
+from main.utils import (
+    delete_object,
+    delete_object_by_condition,
+    iterate_in_thread,
+    paginate_keyset,
+    parse_limit,
+    parse_page_params,
+    run_in_background,
+)
 from rest_framework.views import APIView
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -28,22 +36,57 @@ from main.serializers import (
     FlashcardSerializer,
     ExternalLinkSerializer,
     QuizSerializer,
-    QuestionSerializer,
+    QuizSummarySerializer,
     QuizAttemptSerializer,
     SubmitAnswerSerializer,
-    AnswerSerializer,
     CommentSerializer,
+    CommentThreadSerializer,
+    UnansweredCommentSerializer,
     EnrollmentSerializer,
     NotificationSerializer,
+    QuizStatsSerializer,
+    QuestionStatsSerializer,
+    LeaderboardEntrySerializer,
 )
 from rest_framework import status
 from rest_framework.exceptions import NotFound
 from .permissions import IsStaffOrIsInstructor, IsCommentorOrHasPerms
 import json
-from django.db.models import Q
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from django.utils import timezone
+from django.utils.http import parse_etags
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from main.quiz_payloads import get_quiz_payload, get_quiz_definition, strip_answers
+from main.grading import unpack_answers
+from main.analytics import refresh_quiz_stats, get_leaderboard, get_rank
+from main.gradebook import stream_gradebook_csv, stream_gradebook_jsonl
+from main.quiz_import import import_quizzes
+from main.fanout import record_comment_fanout
+from main.media import collect_deleted_media
+from main.uploads import CommentImageUploadHandler
+from main.search import search_documents
+from main.notifications import (
+    get_notification_page,
+    get_unread_count,
+    mark_notifications_seen,
+)
+from main import roles
+from main.comments import (
+    get_lesson_comments,
+    nest_comments,
+    get_thread_page,
+    get_thread_replies,
+    get_unread_counts,
+    mark_answered,
+    mark_lesson_read,
+    refresh_answered,
+    unanswered_comments,
+)
 
 # Authentication & Authorization
 
@@ -58,7 +101,7 @@ class CustomLoginView(APIView):
             user = serializer.validated_data["user"]
             user_data = AchieveUserSerializer(user).data
             user_data["is_staff"] = user.is_staff
-            user_data["is_instructor"] = user.groups.filter(name="Instructors").exists()
+            user_data["is_instructor"] = roles.is_instructor(user)
             refresh_token = RefreshToken.for_user(user)
             access_token = str(refresh_token.access_token)
             data = {
@@ -103,7 +146,7 @@ class GetUserView(APIView):
 
         data = serializer.data
         data["is_staff"] = request.user.is_staff
-        data["is_instructor"] = request.user.groups.filter(name="Instructors").exists()
+        data["is_instructor"] = roles.is_instructor(request.user)
         return Response(data)
 
 
@@ -275,12 +318,30 @@ class GetQuizzesView(APIView):
 
     def get(self, request, *args, **kwargs):
         module_id = kwargs.get("module_id")
+        summary = request.query_params.get("summary") in ("1", "true")
         try:
-            quizzes = Quiz.objects.filter(module_id=module_id).all()
-
-            data = {
-                "quizzes": QuizSerializer(quizzes, many=True).data,
-            }
+            quizzes = Quiz.objects.filter(module_id=module_id).order_by("id")
+            if summary:
+                # Counts and marks are aggregated in SQL instead of shipping every question
+                quizzes = quizzes.annotate(
+                    question_count=Count("questions"),
+                    question_marks=Coalesce(Sum("questions__question_point"), 0),
+                )
+                data = {
+                    "quizzes": QuizSummarySerializer(quizzes, many=True).data,
+                }
+            else:
+                quizzes = quizzes.select_related("quiz_creator").prefetch_related(
+                    "questions"
+                )
+                quizzes = QuizSerializer(quizzes, many=True).data
+                # Students never receive the correct answers
+                if not roles.is_editor(request.user):
+                    for quiz in quizzes:
+                        quiz["questions"] = strip_answers(quiz["questions"])
+                data = {
+                    "quizzes": quizzes,
+                }
             return Response(data, status=status.HTTP_200_OK)
         except Quiz.DoesNotExist:
             return Response(
@@ -293,18 +354,23 @@ class GetQuizByIdView(APIView):
 
     def get(self, request, *args, **kwargs):
         quiz_id = kwargs.get("quiz_id")
-        try:
-            quiz = get_object_or_404(Quiz, id=quiz_id)
-            questions = Question.objects.filter(quiz=quiz)
-            data = {
-                "quiz": QuizSerializer(quiz).data,
-                "questions": QuestionSerializer(questions, many=True).data,
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        except (Quiz.DoesNotExist, Question.DoesNotExist):
+        version = (
+            Quiz.objects.filter(id=quiz_id).values_list("version", flat=True).first()
+        )
+        if version is None:
             return Response(
                 {"error": "Quiz not found"}, status=status.HTTP_404_NOT_FOUND
             )
+        # Students never receive the correct answers
+        include_answers = roles.is_editor(request.user)
+        body, etag = get_quiz_payload(quiz_id, version, include_answers)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        response["Cache-Control"] = "private, no-cache"
+        return response
 
 
 class GetQuizResultsView(APIView):
@@ -313,25 +379,116 @@ class GetQuizResultsView(APIView):
     def get(self, request, *args, **kwargs):
         attempt_id = kwargs.get("attempt_id")
         try:
+            attempt = QuizAttempt.objects.select_related("taken_by", "quiz").get(
+                id=attempt_id
+            )
+        except QuizAttempt.DoesNotExist:
+            return Response(
+                {"error": "Quiz not found"}, status=status.HTTP_404_NOT_FOUND
+            )
 
-            attempt = QuizAttempt.objects.prefetch_related(
-                "attempt_answers__question"
-            ).get(id=attempt_id)
-            answers = attempt.attempt_answers.all()
+        # Question data comes from the cached quiz definition, not from Question
+        # rows. Only the current version of a quiz is known, questions deleted
+        # since the attempt are reported as missing.
+        definition = get_quiz_definition(attempt.quiz_id, attempt.quiz.version)
+        questions_by_id = {
+            question["id"]: question for question in definition["questions"]
+        }
+        answers = unpack_answers(attempt)
+        data = {
+            "attempt": QuizAttemptSerializer(attempt).data,
+            "questions": [
+                questions_by_id.get(answer["question_id"]) for answer in answers
+            ],
+            "answers": answers,
+            "missing_question_ids": [
+                answer["question_id"]
+                for answer in answers
+                if answer["question_id"] not in questions_by_id
+            ],
+            "quiz_version": attempt.quiz_version,
+            "current_quiz_version": attempt.quiz.version,
+        }
+        return Response(data, status=status.HTTP_200_OK)
 
-            questions = [answer.question for answer in answers]
 
-            data = {
-                "attempt": QuizAttemptSerializer(attempt).data,
-                "questions": QuestionSerializer(questions, many=True).data,
-                "answers": AnswerSerializer(answers, many=True).data,
-            }
-            return Response(data, status=status.HTTP_200_OK)
+class GetQuizAnalyticsView(APIView):
+    permission_classes = [IsAuthenticated, IsStaffOrIsInstructor]
 
-        except (QuizAttempt.DoesNotExist, Answer.DoesNotExist):
+    def get(self, request, *args, **kwargs):
+        quiz_id = kwargs.get("quiz_id")
+        if not Quiz.objects.filter(id=quiz_id).exists():
             return Response(
                 {"error": "Quiz not found"}, status=status.HTTP_404_NOT_FOUND
             )
+        # Only attempts made since the last refresh are read
+        quiz_stats = refresh_quiz_stats(quiz_id)
+        question_stats = (
+            QuestionStats.objects.filter(quiz_id=quiz_id)
+            .select_related("question")
+            .order_by("question_id")
+        )
+        data = {
+            "quiz": QuizStatsSerializer(quiz_stats).data,
+            "questions": QuestionStatsSerializer(question_stats, many=True).data,
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class GetQuizLeaderboardView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        quiz_id = kwargs.get("quiz_id")
+        try:
+            limit = parse_limit(request.query_params, default_limit=10)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not Quiz.objects.filter(id=quiz_id).exists():
+            return Response(
+                {"error": "Quiz not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        my_rank, my_best_score = get_rank(quiz_id, request.user)
+        data = {
+            "leaderboard": LeaderboardEntrySerializer(
+                get_leaderboard(quiz_id, limit), many=True
+            ).data,
+            "my_rank": my_rank,
+            "my_best_score": my_best_score,
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class ExportGradebookView(APIView):
+    permission_classes = [IsAuthenticated, IsStaffOrIsInstructor]
+
+    def get(self, request, *args, **kwargs):
+        course_id = kwargs.get("course_id")
+        export_format = request.query_params.get("export", "csv")
+        score = request.query_params.get("score", "best")
+        if export_format not in ("csv", "jsonl") or score not in ("best", "latest"):
+            return Response(
+                {"error": "export must be csv or jsonl and score best or latest"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not Course.objects.filter(id=course_id).exists():
+            return Response(
+                {"error": "Course not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        if export_format == "csv":
+            rows = stream_gradebook_csv(course_id, score)
+            content_type = "text/csv"
+        else:
+            rows = stream_gradebook_jsonl(course_id, score)
+            content_type = "application/x-ndjson"
+        # The app is served over ASGI, see iterate_in_thread
+        response = StreamingHttpResponse(
+            iterate_in_thread(rows), content_type=content_type
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="course_{course_id}_gradebook.{export_format}"'
+        )
+        return response
 
 
 class GetCommentsView(APIView):
@@ -340,63 +497,139 @@ class GetCommentsView(APIView):
     def get(self, request, *args, **kwargs):
         lesson_id = kwargs.get("lesson_id")
         user = request.user
-
-        if user.is_staff or user.groups.filter(name="Instructors").exists():
-            # Instructors or staff get all comments
-            comments = Comment.objects.filter(lesson_id=lesson_id).prefetch_related(
-                "images", "replies"
+        # Instructors or staff get all comments, students only see their own
+        # threads and the broadcasts
+        is_editor = roles.is_editor(user)
+        if "cursor" in request.query_params or "limit" in request.query_params:
+            # Paginated threads, newest first, replies are loaded per thread
+            try:
+                cursor, limit = parse_page_params(request.query_params)
+            except ValueError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            threads, next_cursor = get_thread_page(
+                lesson_id, user, is_editor, cursor, limit
             )
-            combined_comments = comments
+            data = {
+                "comments": CommentThreadSerializer(threads, many=True).data,
+                "next_cursor": next_cursor,
+            }
+            return Response(data, status=status.HTTP_200_OK)
+        comments = get_lesson_comments(lesson_id, user, is_editor)
+        serialized = CommentSerializer(comments, many=True).data
+        if request.query_params.get("nested") in ("1", "true"):
+            data = {"comments": nest_comments(serialized)}
         else:
-            # Students only see their own comments and broadcasts
-            broadcasts = Comment.objects.filter(
-                Q(commentor__is_staff=True) | Q(commentor__groups__name="Instructors"),
-                lesson_id=lesson_id,
-                reply_to_id=None,
-            ).prefetch_related("images")
-            comments = Comment.objects.filter(
-                Q(commentor=request.user)
-                | Q(reply_to_id__isnull=False),  # Get user's comments + all replies
-                lesson_id=lesson_id,
-            ).prefetch_related("images")
-            student_comments = []
-            replies = []
-            strict_student_replies = []
-
-            for comment in comments:
-                if comment.commentor == request.user and comment.reply_to_id is None:
-                    student_comments.append(comment)
-                else:
-                    replies.append(comment)
-            for comment in student_comments:
-                comment_replies = [
-                    reply for reply in replies if reply.reply_to_id == comment.id
-                ]
-                comment.replies.set(comment_replies)
-                strict_student_replies.extend(comment_replies)
-
-            combined_comments = (
-                student_comments + strict_student_replies + list(broadcasts)
-            )
-        data = {"comments": CommentSerializer(combined_comments, many=True).data}
+            data = {"comments": serialized}
         return Response(data, status=status.HTTP_200_OK)
 
 
-class GetNotificationsView(APIView):
+class GetCommentRepliesView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        reciever_id = request.user.id
+        comment_id = kwargs.get("comment_id")
+        user = request.user
+        is_editor = roles.is_editor(user)
         try:
-            notifications = Notification.objects.filter(reciever_id=reciever_id).all()
-            data = {
-                "notifications": NotificationSerializer(notifications, many=True).data
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        except Notification.DoesNotExist:
+            cursor, limit = parse_page_params(request.query_params, default_limit=50)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        replies, next_cursor = get_thread_replies(
+            comment_id, user, is_editor, cursor, limit
+        )
+        if replies is None:
+            return Response(
+                {"error": "Comment not found"}, status=status.HTTP_404_NOT_FOUND
+            )
+        data = {
+            "replies": CommentSerializer(replies, many=True).data,
+            "next_cursor": next_cursor,
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class SearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        text = request.query_params.get("q", "").strip()
+        kind = request.query_params.get("kind")
+        if not text:
+            return Response(
+                {"error": "q is required"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if kind is not None and kind not in dict(SearchDocument.KIND_CHOICES):
+            return Response(
+                {"error": "Invalid kind"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            limit = parse_limit(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        is_editor = roles.is_editor(user)
+        results = search_documents(user, is_editor, text, limit=limit, kind=kind)
+        return Response({"results": results}, status=status.HTTP_200_OK)
+
+
+class GetUnreadCommentCountsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        course_id = kwargs.get("course_id")
+        user = request.user
+        is_editor = roles.is_editor(user)
+        data = {"unread": get_unread_counts(course_id, user, is_editor)}
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class MarkLessonReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        lesson_id = kwargs.get("lesson_id")
+        if not Module.objects.filter(id=lesson_id).exists():
             return Response(
-                {"error:notification was not found"}, status=status.HTTP_404_NOT_FOUND
+                {"error": "Lesson not found"}, status=status.HTTP_404_NOT_FOUND
             )
+        mark_lesson_read(lesson_id, request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class GetUnansweredCommentsView(APIView):
+    permission_classes = [IsAuthenticated, IsStaffOrIsInstructor]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            cursor, limit = parse_page_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        comments, next_cursor = paginate_keyset(
+            unanswered_comments(request.user), "commented_at", cursor, limit
+        )
+        data = {
+            "comments": UnansweredCommentSerializer(comments, many=True).data,
+            "next_cursor": next_cursor,
+        }
+        return Response(data, status=status.HTTP_200_OK)
+
+
+class GetNotificationsView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        try:
+            cursor, limit = parse_page_params(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        user = request.user
+        notifications, next_cursor = get_notification_page(user, cursor, limit)
+        data = {
+            "notifications": NotificationSerializer(notifications, many=True).data,
+            "next_cursor": next_cursor,
+            "unread_count": get_unread_count(user),
+        }
+        return Response(data, status=status.HTTP_200_OK)
 
 
 # Functionality
@@ -620,6 +853,31 @@ class AddQuizView(APIView):
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+class ImportQuizzesView(APIView):
+    permission_classes = [IsAuthenticated, IsStaffOrIsInstructor]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get("file")
+        if upload is None:
+            return Response(
+                {"error": "A question bank file is required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        file_format = request.data.get("file_format") or upload.name.rsplit(".", 1)[-1]
+        file_format = file_format.lower()
+        if file_format not in ("csv", "json", "jsonl"):
+            return Response(
+                {"error": "Supported formats are csv, json and jsonl"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        module = get_object_or_404(Module, id=request.data.get("module_id"))
+
+        report = import_quizzes(upload, file_format, module, request.user)
+        if "errors" in report:
+            return Response(report, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_201_CREATED)
+
+
 class SubmitAnswersView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -635,6 +893,7 @@ class SubmitAnswersView(APIView):
             if serializer.is_valid():
                 serializer.save()
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Quiz.DoesNotExist:
 
             return Response(
@@ -668,135 +927,31 @@ class DeleteQuizView(APIView):
 class AddCommentView(APIView):
     permission_classes = [IsAuthenticated]
 
-    def post(self, request, *args, **kwargs):
+    def initialize_request(self, request, *args, **kwargs):
+        # Images are validated while they are streamed to disk, this has to be
+        # set before anything reads the body
+        self.upload_handler = CommentImageUploadHandler(request)
+        request.upload_handlers = [self.upload_handler]
+        return super().initialize_request(request, *args, **kwargs)
 
-        serializer = CommentSerializer(data=request.data, context={"request": request})
+    def post(self, request, *args, **kwargs):
+        data = request.data
+        if self.upload_handler.error:
+            return Response(
+                {"images": [self.upload_handler.error]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        serializer = CommentSerializer(data=data, context={"request": request})
         if serializer.is_valid():
-            serializer.save()
-            # Send WebSocket message
-            is_broadcast = False
-            comment = serializer.data
-            commentor_id = request.user.id
-            name = request.user.first_name
-            channel_layer = get_channel_layer()
-            if comment["reply_to_id"] is not None:
-                info = (
-                    Comment.objects.select_related("commentor", "lesson")
-                    .filter(id=comment["reply_to_id"])
-                    .only(
-                        "lesson__module_title",
-                        "lesson__id",
-                        "commentor__id",
-                        "commentor__first_name",
-                    )
-                    .first()
-                )
-                lesson = info.lesson.module_title
-                reciever_id = info.commentor.id if info else None
-                # a student might reply to himself and that would create a duplication
-                if reciever_id != request.user.id:
-                    if info.commentor.groups.filter(name="Students").exists():
-                        private_group_name = f"user_{reciever_id}"
-                        notification = Notification.objects.create(
-                            reciever_id=reciever_id,
-                            message=f"{name} replied to your comment in lesson {lesson}",
-                            comment_id=comment["reply_to_id"],
-                        )
-                        async_to_sync(channel_layer.group_send)(
-                            private_group_name,
-                            {"type": "comment_created", "message": comment},
-                        )
-                        async_to_sync(channel_layer.group_send)(
-                            private_group_name,
-                            {
-                                "type": "notification",
-                                "message": NotificationSerializer(notification).data,
-                            },
-                        )
-                    elif (
-                        info.commentor.groups.filter(name="Instructors").exists()
-                        or info.commentor.is_staff
-                    ):
-                        staff_not = Notification.objects.create(
-                            reciever_id=reciever_id,
-                            message=f"{name} replied to you in lesson  {lesson}",
-                            comment_id=comment["reply_to_id"],
-                        )
-                        async_to_sync(channel_layer.group_send)(
-                            "Editors",
-                            {
-                                "type": "notification",
-                                "message": NotificationSerializer(staff_not).data,
-                            },
-                        )
-
-                # values is used with filter not get since its a queryset, to access the first result we use first
-            # If commentor is student
-            if not (
-                request.user.is_staff
-                or request.user.groups.filter(name="Instructors").exists()
-            ):
-                private_student_group_name = f"user_{commentor_id}"
-                async_to_sync(channel_layer.group_send)(
-                    private_student_group_name,
-                    {"type": "comment_created", "message": comment},
-                )
-                if comment["reply_to_id"] is None:  # No replyyy
-                    staff_notification = Notification.objects.create(
-                        lesson_id=comment["lesson_id"],
-                        message=f"A student left a comment",
-                        comment_id=comment["id"],
-                    )
-                    async_to_sync(channel_layer.group_send)(
-                        "Editors",
-                        {
-                            "type": "notification",
-                            "message": NotificationSerializer(staff_notification).data,
-                        },
-                    )
-
-            # IF ITS A BROADCAST
-            if (
-                request.user.is_staff
-                or request.user.groups.filter(name="Instructors").exists()
-            ) and comment["reply_to_id"] is None:
-                is_broadcast = True
-                broadcast_notification = Notification.objects.create(
-                    lesson_id=comment["lesson_id"],
-                    message=f"{name} added a new broadcast to lesson {comment["lesson_id"]}",
-                    comment_id=comment["id"],
-                )
-                async_to_sync(channel_layer.group_send)(
-                    "Students",  # Group name
-                    {"type": "comment_created", "message": comment},
-                )
-                async_to_sync(channel_layer.group_send)(
-                    "Students",
-                    {
-                        "type": "notification",
-                        "message": NotificationSerializer(broadcast_notification).data,
-                    },
-                )
-            async_to_sync(channel_layer.group_send)(
-                "Editors",  # Group name
-                {"type": "comment_created", "message": comment},
-            )
-            if is_broadcast:
-                staff_broadcast_notification = Notification.objects.create(
-                    message=f"A new broadcast has been added to lesson {comment["lesson_id"]}",
-                    lesson_id=comment["lesson_id"],
-                    comment_id=comment["id"],
-                )
-                async_to_sync(channel_layer.group_send)(
-                    "Editors",
-                    {
-                        "type": "notification",
-                        "message": NotificationSerializer(
-                            staff_broadcast_notification
-                        ).data,
-                    },
-                )
-
+            user = request.user
+            is_editor = roles.is_editor(user)
+            # Notifications and WebSocket events are sent by main/fanout.py once
+            # the comment is committed
+            with transaction.atomic():
+                comment = serializer.save(answered=is_editor)
+                if is_editor and comment.reply_to_id is not None:
+                    mark_answered(comment.reply_to_id)
+                record_comment_fanout(comment)
             return Response(status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -819,7 +974,12 @@ class DeleteCommentView(APIView):
 
         # Check permissions, raise exception in case of permission denial
         self.check_object_permissions(request, comment)
-        comment.delete()
+        with transaction.atomic():
+            comment.delete()
+            if comment.reply_to_id is not None:
+                refresh_answered([comment.reply_to_id])
+        if settings.MEDIA_GC_IN_PROCESS:
+            transaction.on_commit(lambda: run_in_background(collect_deleted_media))
         channel_layer = get_channel_layer()
         async_to_sync(channel_layer.group_send)(
             "LMS",
@@ -855,6 +1015,7 @@ class EnrollUserView(APIView):
             enrolled_by_id = enrolled_by["id"]
             noti_message = f"you have been enrolled in course: {course["course_title"]}:{course["id"]}"
             notification = Notification.objects.create(
+                kind=Notification.ENROLLMENT,
                 reciever_id=user_id,
                 message=noti_message,
                 enrollment_id=serializer.data["id"],
@@ -927,19 +1088,13 @@ class UpdateLastSeenNotView(APIView):
     permission_classes = [IsAuthenticated]
 
     def patch(self, request, *args, **kwargs):
-        try:
-            print(request.data)
-            user = request.user
-            user.last_seen_notifications = timezone.now()
-            user.save()
-            data = {
-                "last_seen_notifications": AchieveUserSerializer(user).data[
-                    "last_seen_notifications"
-                ]
-            }
-            return Response(data, status=status.HTTP_200_OK)
-        except Exception as e:
-            print("UpdateLastSeenNotView error:", e)
-            return Response(
-                {"error": f"Invalid data provided {e}."}, status=status.HTTP_400_BAD_REQUEST
-            )
+        user = request.user
+        user.last_seen_notifications = timezone.now()
+        # A single column update, rapid calls are coalesced
+        mark_notifications_seen(user, user.last_seen_notifications)
+        data = {
+            "last_seen_notifications": AchieveUserSerializer(user).data[
+                "last_seen_notifications"
+            ]
+        }
+        return Response(data, status=status.HTTP_200_OK)